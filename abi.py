@@ -1,61 +1,205 @@
 import os
+import re
 import json
+import shutil
+import hashlib
+import subprocess
 from typing import List, Dict
+from eth_abi.registry import registry
+from eth_utils import function_abi_to_4byte_selector
+from eth_utils.abi import collapse_if_tuple
 
 
-def get_functions(test_file_name) -> (List, Dict):
-    functions = {}
-    contract_set = set()
+# Compiled outputs, one per hash of the sources and of the solc version
+ARTIFACT_CACHE_DIR = ".fuzz_cache/artifacts"
 
-    with open(f"crytic-export/{test_file_name.split('/')[-1]}.json") as crytic_out:
-        out_info = json.load(crytic_out)
-        unit = list(out_info["compilation_units"].keys())[0]
+IMPORT_PATTERN = re.compile(r"""import\s+(?:[^'"]*?\s+from\s+)?["']([^"']+)["']""")
 
-        contracts = out_info["compilation_units"][unit]["contracts"][unit]
-        contract_names = list(contracts.keys())
+# In-memory index of the artifacts already loaded, by test file name
+_artifacts = dict()
 
-        for contract in contracts:
-            contract_set.add(contract)
-            functions[contract] = [
-                data
-                for data in contracts[contract]["abi"]
-                if data["type"] == "function"
-                and data["stateMutability"] != "view"
-                and data["stateMutability"] != "pure"
-            ]
 
-            # If the internalType of an input starts with `contract` we should save it,
-            # and look for it in the other abis, then deduce which functions are available to us
+class CompilationException(Exception):
+    """The test file could not be compiled."""
 
-    return (contract_names, functions)
+    pass
 
 
-def get_abi_and_bytecode(test_file_name):
-    abi = {}
-    bytecode = {}
-    contract_set = set()
+class Artifact:
+    """Contracts, ABIs, bytecodes and ASTs of a compiled test file, parsed once."""
 
-    with open(f"crytic-export/{test_file_name.split('/')[-1]}.json") as crytic_out:
-        out_info = json.load(crytic_out)
+    def __init__(self, path, out_info):
+        self.path = path
         unit = list(out_info["compilation_units"].keys())[0]
-
+        self.asts = out_info["compilation_units"][unit].get("asts", {})
         contracts = out_info["compilation_units"][unit]["contracts"][unit]
-        contract_names = list(contracts.keys())
+        self.contract_names = list(contracts.keys())
+        self.abis = {name: contracts[name]["abi"] for name in contracts}
+        self.bytecodes = {name: contracts[name]["bin"] for name in contracts}
+        self.runtime_bytecodes = {
+            name: contracts[name].get("bin-runtime", "") for name in contracts
+        }
+
+
+def source_files(test_file_name):
+    """Return the test file and every local file it imports, recursively, None if an import cannot be found.
+
+    Non-relative imports are looked up from the directory of the importing
+    file, then from the working directory.
+    """
+    files = []
+    to_visit = [os.path.abspath(test_file_name)]
+    while to_visit:
+        path = to_visit.pop()
+        if path in files:
+            continue
+        files.append(path)
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for imported in IMPORT_PATTERN.findall(f.read()):
+                candidates = [os.path.join(os.path.dirname(path), imported)]
+                if not imported.startswith("."):
+                    candidates.append(os.path.abspath(imported))
+                found = [c for c in candidates if os.path.isfile(c)]
+                if not found:  # resolved by solc through remappings, for instance
+                    return None
+                to_visit.append(os.path.normpath(found[0]))
+    return sorted(files)
+
+
+def solc_version():
+    try:
+        return subprocess.run(
+            ["solc", "--version"], capture_output=True, text=True
+        ).stdout
+    except OSError:
+        return ""
+
+
+def source_hash(test_file_name):
+    """Return the hash of the sources of the test file and of the solc version, None if some sources cannot be found."""
+    files = source_files(test_file_name)
+    if files is None:
+        return None
+    h = hashlib.sha256(solc_version().encode())
+    for path in files:
+        h.update(path.encode())
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def compile_contract(
+    test_file_name, cache_dir=ARTIFACT_CACHE_DIR, export_dir="crytic-export"
+):
+    """Compile the test file with crytic-compile, unless its sources were already compiled.
+
+    Return the path of the cached crytic-compile export. Concurrent compilations need distinct `export_dir`.
+    When some imported sources cannot be found to hash them, the test file is
+    always compiled, and its export is named after the hash of its content.
+    """
+    digest = source_hash(test_file_name)
+    if digest is not None:
+        cached = os.path.join(cache_dir, f"{digest}.json")
+        if os.path.exists(cached):
+            return cached
+    proc = subprocess.run(
+        [
+            "crytic-compile",
+            "--export-format",
+            "standard",
+            "--export-dir",
+            export_dir,
+            test_file_name,
+        ],
+        capture_output=True,
+        text=True,
+    )
+    export = os.path.join(export_dir, f"{test_file_name.split('/')[-1]}.json")
+    if proc.returncode != 0 or not os.path.exists(export):
+        raise CompilationException(proc.stderr)
+    if digest is None:
+        with open(export, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        cached = os.path.join(cache_dir, f"{digest}.json")
+    os.makedirs(cache_dir, exist_ok=True)
+    shutil.move(export, cached)
+    return cached
+
+
+def load_artifact(test_file_name):
+    """Return the parsed artifact of the test file, compiling it if needed."""
+    if test_file_name not in _artifacts:
+        path = compile_contract(test_file_name)
+        with open(path) as crytic_out:
+            _artifacts[test_file_name] = Artifact(path, json.load(crytic_out))
+    return _artifacts[test_file_name]
+
+
+def function_encoder(func):
+    """Return the 4-byte selector of a function and an encoder of its argument tuple."""
+    arg_types = [collapse_if_tuple(arg) for arg in func["inputs"]]
+    if not arg_types:
+        # eth_abi has no encoder for the empty tuple
+        return function_abi_to_4byte_selector(func), encode_no_args
+    encoder = registry.get_encoder(f"({','.join(arg_types)})")
+    return function_abi_to_4byte_selector(func), encoder
+
+
+def encode_no_args(args):
+    return b""
+
+
+class CompiledFunction:
+    """A deployed contract function whose calldata encoding is built once.
+
+    Hypothesis draws a single value for functions with one argument and a tuple
+    for functions with several, `calldata` maps such a draw to raw calldata.
+    """
+
+    __slots__ = ("name", "address", "selector", "encoder", "num_args")
+
+    def __init__(self, address, func):
+        if "encoder" not in func:
+            func["selector"], func["encoder"] = function_encoder(func)
+        self.name = func["name"]
+        self.address = address
+        self.selector = func["selector"]
+        self.encoder = func["encoder"]
+        self.num_args = len(func["inputs"])
+
+    def calldata(self, args=()):
+        if self.num_args == 1:
+            args = (args,)
+        return "0x" + (self.selector + self.encoder(args)).hex()
+
+    def __repr__(self):
+        return self.name
+
+
+def get_functions(test_file_name) -> (List, Dict):
+    artifact = load_artifact(test_file_name)
+    functions = {}
 
-        for contract in contracts:
-            contract_set.add(contract)
-            abi[contract] = contracts[contract]["abi"]
-            bytecode[contract] = contracts[contract]["bin"]
+    for contract in artifact.contract_names:
+        # copies, so that strategies and encoders are not stored in the cached ABIs
+        functions[contract] = [
+            dict(data)
+            for data in artifact.abis[contract]
+            if data["type"] == "function"
+            and data["stateMutability"] != "view"
+            and data["stateMutability"] != "pure"
+        ]
 
-    return (abi, bytecode)
+        # If the internalType of an input starts with `contract` we should save it,
+        # and look for it in the other abis, then deduce which functions are available to us
 
+    return (artifact.contract_names, functions)
 
-def get_abi_by_name(contract_name, test_file_name):
-    abi = {}
 
-    with open(f"crytic-export/{test_file_name.split('/')[-1]}.json") as crytic_out:
-        out_info = json.load(crytic_out)
-        unit = list(out_info["compilation_units"].keys())[0]
-        contracts = out_info["compilation_units"][unit]["contracts"][unit]
+def get_abi_and_bytecode(test_file_name):
+    artifact = load_artifact(test_file_name)
+    return (artifact.abis, artifact.bytecodes)
 
-    return contracts[contract_name]["abi"]
+
+def get_abi_by_name(contract_name, test_file_name):
+    return load_artifact(test_file_name).abis[contract_name]
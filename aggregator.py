@@ -0,0 +1,50 @@
+# Address at which the aggregator code is injected with an eth_call state override
+AGGREGATOR_ADDRESS = "0x0000000000000000000000000000000000fa11ed"
+
+PUSH1 = "60"
+PUSH2 = "61"
+PUSH4 = "63"
+PUSH20 = "73"
+MLOAD = "51"
+MSTORE = "52"
+SHL = "1b"
+ISZERO = "15"
+AND = "16"
+OR = "17"
+GAS = "5a"
+CALL = "f1"
+RETURN = "f3"
+
+
+class AggregatorException(Exception):
+    """Too many invariants to fit in a single bitmask."""
+
+    pass
+
+
+def aggregator_code(invariants):
+    """Generate the runtime bytecode of a contract calling every invariant.
+
+    The contract returns a 256 bit mask in which bit i is set if the i-th
+    invariant reverted or returned false. Each invariant is called with its
+    selector written at memory[0:4], and its return value is read at
+    memory[32:64], which is cleared before each call.
+    """
+    if len(invariants) > 256:
+        raise AggregatorException("at most 256 invariants can be aggregated")
+    code = PUSH1 + "00"  # failure mask
+    for i, inv in enumerate(invariants):
+        code += PUSH1 + "00" + PUSH1 + "20" + MSTORE
+        code += PUSH4 + inv.selector.hex() + PUSH1 + "e0" + SHL + PUSH1 + "00" + MSTORE
+        code += PUSH1 + "20" + PUSH1 + "20" + PUSH1 + "04" + PUSH1 + "00" + PUSH1 + "00"
+        code += PUSH20 + inv.address[2:].lower() + GAS + CALL
+        code += PUSH1 + "20" + MLOAD + ISZERO + ISZERO + AND + ISZERO
+        code += PUSH2 + f"{i:04x}" + SHL + OR
+    code += PUSH1 + "00" + MSTORE + PUSH1 + "20" + PUSH1 + "00" + RETURN
+    return "0x" + code
+
+
+def decode_mask(result, invariants):
+    """Return the names of the invariants whose bit is set in the mask returned by the aggregator."""
+    mask = int(result[2:] or "0", 16)
+    return [inv.name for i, inv in enumerate(invariants) if mask >> i & 1]
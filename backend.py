@@ -0,0 +1,283 @@
+from abc import ABC, abstractmethod
+from coverage_tracker import ENTRY, code_id, pack_id
+
+# Gas limit of the transactions and calls executed by the backends
+GAS_LIMIT = 15000000
+CHAIN_ID = 1
+
+# Address #1 when anvil is run by default, the in-process backend uses it as sender too
+DEFAULT_SENDER = "0xf39Fd6e51aad88F6F4ce6aB8827279cffFb92266"
+
+# Opcodes which may change the state : SSTORE, CREATE, CREATE2, SELFDESTRUCT
+WRITE_OPCODES = (0x55, 0xF0, 0xF5, 0xFF)
+
+# JUMP, JUMPI
+JUMP_OPCODES = (0x56, 0x57)
+
+# LT, GT, SLT, SGT, EQ
+COMPARISON_OPCODES = (0x10, 0x11, 0x12, 0x13, 0x14)
+
+BACKENDS = ("anvil", "pyevm")
+
+
+class BackendException(Exception):
+    """The execution backend is not available."""
+
+    pass
+
+
+class Backend(ABC):
+    """A chain on which the fuzzer deploys contracts and executes transactions.
+
+    Addresses and calldata are 0x-prefixed hex strings. Reverting to a
+    snapshot consumes it along with every snapshot taken after it.
+    """
+
+    @abstractmethod
+    def deploy(self, bytecode):
+        """Deploy a contract from its creation bytecode, return its address."""
+
+    @abstractmethod
+    def call(self, to, data):
+        """Call a contract without changing the state, return whether it succeeded and its return data."""
+
+    @abstractmethod
+    def transact(self, to, data):
+        """Execute a transaction.
+
+        Return whether it succeeded, its coverage IDs (see
+        `coverage_tracker.pack_id`) and whether it may have changed the state.
+        """
+
+    @abstractmethod
+    def get_code(self, address):
+        """Return the runtime bytecode deployed at `address`."""
+
+    @abstractmethod
+    def snapshot(self):
+        pass
+
+    @abstractmethod
+    def revert(self, snapshotID):
+        pass
+
+
+class AnvilBackend(Backend):
+    """An anvil node reached over JSON-RPC, transactions are sent from its unlocked account."""
+
+    def __init__(self, w3, rpc, account, tracer=None):
+        self.w3 = w3
+        self.rpc = rpc
+        self.account = account
+        self.tracer = tracer
+
+    def _transaction(self, to, data):
+        tx = {"from": self.account, "data": data, "gas": hex(GAS_LIMIT)}
+        if to is not None:
+            tx["to"] = to
+        tx_hash = self.rpc.request("eth_sendTransaction", [tx])
+        return tx_hash, self.w3.eth.wait_for_transaction_receipt(
+            tx_hash, poll_latency=0.01
+        )
+
+    def deploy(self, bytecode):
+        _, receipt = self._transaction(None, bytecode)
+        return receipt["contractAddress"]
+
+    def call(self, to, data):
+        response = self.rpc.batch(
+            [("eth_call", [{"from": self.account, "to": to, "data": data}, "latest"])]
+        )[0]
+        if "error" in response:
+            return False, b""
+        return True, bytes.fromhex(response["result"][2:])
+
+    def transact(self, to, data):
+        tx_hash, receipt = self._transaction(to, data)
+        ids, writes = set(), True
+        if self.tracer is not None:
+            ids, writes, _ = self.tracer.collect(tx_hash, to)
+        return receipt["status"] == 1, ids, writes
+
+    def get_code(self, address):
+        return bytes.fromhex(self.rpc.request("eth_getCode", [address, "latest"])[2:])
+
+    def snapshot(self):
+        return self.rpc.request("evm_snapshot", [])
+
+    def revert(self, snapshotID):
+        self.rpc.request("evm_revert", [snapshotID])
+
+
+def hooked_computation(computation_class, hook):
+    """Subclass a py-evm computation so that `hook(computation, opcode)` is called before every executed opcode.
+
+    Sub-calls are executed by the same class, so they are hooked too.
+    """
+    opcodes = {
+        value: _hooked_opcode(value, opcode_fn, hook)
+        for value, opcode_fn in computation_class.opcodes.items()
+    }
+    return type(
+        f"Hooked{computation_class.__name__}", (computation_class,), {"opcodes": opcodes}
+    )
+
+
+def _hooked_opcode(value, opcode_fn, hook):
+    def hooked(computation):
+        hook(computation, value)
+        opcode_fn(computation=computation)
+
+    hooked.mnemonic = opcode_fn.mnemonic
+    hooked.gas_cost = opcode_fn.gas_cost
+    return hooked
+
+
+class PyEVMBackend(Backend):
+    """An in-process EVM (py-evm), without any serialization or socket between the fuzzer and the chain.
+
+    Transactions are applied as messages to the state of a single pending
+    block, snapshots are checkpoints of the journal of that state, and the
+    coverage IDs of `coverage_key` are recorded at every depth by an opcode
+    hook instead of a trace. Gas is neither bought nor refunded, which does not
+    change the fuzzed logic. With a `dictionary`, the hook also collects the
+    operands of comparisons.
+    """
+
+    def __init__(
+        self,
+        sender=DEFAULT_SENDER,
+        balance=10**24,
+        dictionary=None,
+        coverage_key="edge",
+    ):
+        try:
+            from eth import constants
+            from eth.chains.base import MiningChain
+            from eth.db.atomic import AtomicDB
+            from eth.vm.forks.london import LondonVM
+            from eth.vm.message import Message
+            from eth._utils.address import generate_contract_address
+        except ImportError:
+            raise BackendException(
+                "py-evm was not found, you can install it with: pip install py-evm"
+            )
+        self.sender = bytes.fromhex(sender[2:])
+        chain_class = MiningChain.configure(
+            __name__="FuzzChain",
+            vm_configuration=((constants.GENESIS_BLOCK_NUMBER, LondonVM),),
+            chain_id=CHAIN_ID,
+        )
+        chain = chain_class.from_genesis(
+            AtomicDB(),
+            {
+                "coinbase": constants.ZERO_ADDRESS,
+                "difficulty": 1,
+                "gas_limit": 2 * GAS_LIMIT,
+                "timestamp": 1514764800,
+            },
+            {
+                self.sender: {
+                    "balance": balance,
+                    "nonce": 0,
+                    "code": b"",
+                    "storage": {},
+                }
+            },
+        )
+        self.state = chain.get_vm().state
+        self.tx_context = self.state.get_transaction_context_class()(
+            gas_price=1, origin=self.sender
+        )
+        self.computation = hooked_computation(self.state.computation_class, self._hook)
+        self.Message = Message
+        self.create_address = generate_contract_address
+        self.CREATE_CONTRACT_ADDRESS = constants.CREATE_CONTRACT_ADDRESS
+        self.coverage_key = coverage_key
+        # coverage IDs of the current transaction, None outside of transactions
+        self.ids = None
+        # code identifier and source of the next edge of every frame of the current transaction
+        self.frames = dict()
+        self.code_ids = dict()
+        self.writes = False
+        self.dictionary = dictionary
+
+    def _hook(self, computation, opcode):
+        if self.ids is not None:
+            frame = self.frames.get(computation)
+            if frame is None:
+                code = computation.msg.code
+                if code not in self.code_ids:
+                    self.code_ids[code] = code_id(code)
+                frame = self.frames[computation] = [self.code_ids[code], ENTRY]
+            # the code stream already moved past the opcode
+            pc = computation.code.program_counter - 1
+            if self.coverage_key == "pc":
+                self.ids.add(pack_id(frame[0], 0, pc))
+            elif frame[1] is not None:
+                self.ids.add(pack_id(frame[0], frame[1], pc))
+            frame[1] = pc if opcode in JUMP_OPCODES else None
+        if opcode in WRITE_OPCODES:
+            self.writes = True
+        elif self.dictionary is not None and opcode in COMPARISON_OPCODES:
+            for _, operand in computation._stack.values[-2:]:
+                if isinstance(operand, bytes):
+                    operand = int.from_bytes(operand, "big")
+                self.dictionary.add(operand)
+
+    def _apply(self, to, data):
+        to = bytes.fromhex(to[2:])
+        message = self.Message(
+            gas=GAS_LIMIT,
+            to=to,
+            sender=self.sender,
+            value=0,
+            data=bytes.fromhex(data[2:]),
+            code=self.state.get_code(to),
+        )
+        return self.computation.apply_message(self.state, message, self.tx_context)
+
+    def deploy(self, bytecode):
+        address = self.create_address(self.sender, self.state.get_nonce(self.sender))
+        self.state.increment_nonce(self.sender)
+        message = self.Message(
+            gas=GAS_LIMIT,
+            to=self.CREATE_CONTRACT_ADDRESS,
+            sender=self.sender,
+            value=0,
+            data=b"",
+            code=bytes.fromhex(bytecode[2:]),
+            create_address=address,
+        )
+        computation = self.computation.apply_create_message(
+            self.state, message, self.tx_context
+        )
+        if computation.is_error:
+            raise BackendException(f"deployment failed: {computation.error}")
+        return "0x" + address.hex()
+
+    def call(self, to, data):
+        snapshot = self.state.snapshot()
+        computation = self._apply(to, data)
+        self.state.revert(snapshot)
+        return computation.is_success, computation.output
+
+    def transact(self, to, data):
+        self.ids = set()
+        self.writes = False
+        try:
+            computation = self._apply(to, data)
+            ids = self.ids
+        finally:
+            self.ids = None
+            self.frames = dict()
+        return computation.is_success, ids, self.writes and computation.is_success
+
+    def get_code(self, address):
+        return self.state.get_code(bytes.fromhex(address[2:]))
+
+    def snapshot(self):
+        return self.state.snapshot()
+
+    def revert(self, snapshotID):
+        self.state.revert(snapshotID)
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import tempfile
+import contextlib
+import multiprocessing
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import typer
+import yaml
+from abi import compile_contract, load_artifact, CompilationException
+from corpus import Corpus
+from node import AnvilPool
+from fuzzer import run_campaign, corpus_path
+
+# Logs of the campaigns, one file per test file
+BATCH_DIR = ".fuzz_cache/batch"
+
+# Ports reserved per worker process, from its base port : its campaign node, then the replicas of its shrinker
+PORT_STRIDE = 128
+
+# Node pool and base port of a worker process
+_pool = None
+_base_port = None
+
+
+def _init_worker(counter, anvil_port):
+    global _pool, _base_port
+    with counter.get_lock():
+        k = counter.value
+        counter.value += 1
+    _base_port = anvil_port + k * PORT_STRIDE
+    _pool = AnvilPool(_base_port)
+    # worker processes do not run atexit handlers, but run the multiprocessing finalizers
+    Finalize(_pool, _pool.close, exitpriority=10)
+
+
+def find_test_files(tests):
+    """Return the .sol files of a directory (recursively), or the files matching a glob."""
+    if os.path.isdir(tests):
+        return sorted(glob.glob(os.path.join(tests, "**", "*.sol"), recursive=True))
+    return sorted(glob.glob(tests, recursive=True))
+
+
+def compile_all(test_files, jobs):
+    """Compile the test files in parallel, return the compilation errors by test file."""
+
+    def compile_one(test_file_name):
+        export_dir = tempfile.mkdtemp(prefix="crytic-export-")
+        try:
+            compile_contract(test_file_name, export_dir=export_dir)
+        finally:
+            shutil.rmtree(export_dir, ignore_errors=True)
+
+    errors = dict()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(compile_one, f): f for f in test_files}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except CompilationException as e:
+                errors[futures[future]] = str(e)
+    return errors
+
+
+def has_invariants(test_file_name):
+    return any(
+        data.get("type") == "function" and data.get("name", "").startswith("invariant")
+        for abi in load_artifact(test_file_name).abis.values()
+        for data in abi
+    )
+
+
+def run_suite(test_file_name, conf):
+    """Run the campaign of a test file in a worker process, on a node of its pool, return its report entry."""
+    conf = dict(conf, anvil_port=_base_port)
+    log_name = os.path.splitext(os.path.normpath(test_file_name))[0].replace(os.sep, "_")
+    log_path = os.path.join(BATCH_DIR, log_name + ".log")
+    entry = {"test_file": test_file_name, "log": log_path}
+    stats = dict()
+    node = None
+    if conf.get("backend", "anvil") == "anvil":
+        node = _pool.acquire()
+    try:
+        with open(log_path, "w") as log, contextlib.redirect_stdout(log):
+            if conf.get("corpus_dir") and conf.get("corpus_minimize", True):
+                Corpus(corpus_path(conf["corpus_dir"], test_file_name)).minimize()
+            broken = run_campaign(
+                test_file_name,
+                conf,
+                _base_port,
+                conf["fuzz_runs"],
+                node=node,
+                stats=stats,
+            )
+        entry["status"] = "broken" if broken else "passed"
+    except Exception as e:
+        entry["status"] = "error"
+        entry["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if node is not None:
+            _pool.release(node)
+    entry.update(stats)
+    time_budget = conf.get("time_budget")
+    entry["timed_out"] = bool(
+        entry["status"] == "passed"
+        and time_budget
+        and stats.get("duration", 0) >= time_budget
+    )
+    return entry
+
+
+def batch(
+    tests: str = typer.Argument(..., help="directory or glob of the test files"),
+    config_file: str = typer.Option("config.yaml", help="config of every campaign"),
+    jobs: int = typer.Option(0, help="campaigns run in parallel, 0 for one per core"),
+    time_budget: float = typer.Option(
+        0, help="time budget of each campaign in seconds, 0 to keep the config value"
+    ),
+    output: str = typer.Option("batch.json", help="JSON report"),
+):
+    """Fuzz many test files in one go, on warm nodes shared by the campaigns, and write a consolidated report.
+
+    The test files are compiled in parallel, then their campaigns are
+    scheduled on `jobs` worker processes. Each worker imports the fuzzer once
+    and keeps its anvil node between campaigns, resetting it instead of
+    starting a new one. Campaigns run with a single worker each, the output of
+    each campaign goes to its log file.
+    """
+    started = time.perf_counter()
+    with open(config_file, "rb") as f:
+        conf = yaml.safe_load(f.read())
+    if time_budget:
+        conf["time_budget"] = time_budget
+    jobs = jobs or os.cpu_count()
+
+    test_files = find_test_files(tests)
+    if not test_files:
+        print(f"No test file matches {tests}")
+        sys.exit(-1)
+    os.makedirs(BATCH_DIR, exist_ok=True)
+
+    entries = []
+    errors = compile_all(test_files, jobs)
+    for test_file_name, error in errors.items():
+        entries.append({"test_file": test_file_name, "status": "error", "error": error})
+    suites = []
+    for test_file_name in test_files:
+        if test_file_name in errors:
+            continue
+        if has_invariants(test_file_name):
+            suites.append(test_file_name)
+        else:
+            entries.append({"test_file": test_file_name, "status": "skipped"})
+    compiled = time.perf_counter()
+
+    counter = multiprocessing.Value("i", 0)
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, max(len(suites), 1)),
+        initializer=_init_worker,
+        initargs=(counter, conf["anvil_port"]),
+    ) as pool:
+        futures = [pool.submit(run_suite, suite, conf) for suite in suites]
+        for future in as_completed(futures):
+            entry = future.result()
+            entries.append(entry)
+            print(f"{entry['status']:<8} {entry['test_file']}", flush=True)
+
+    entries.sort(key=lambda entry: entry["test_file"])
+    report = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": conf,
+        "jobs": jobs,
+        "wall_clock": time.perf_counter() - started,
+        "compilation": compiled - started,
+        # campaigns run in parallel, so the wall clock is about fuzzing_time / jobs
+        "fuzzing_time": sum(entry.get("duration", 0) for entry in entries),
+        "counts": {
+            status: sum(entry["status"] == status for entry in entries)
+            for status in ("broken", "passed", "error", "skipped")
+        },
+        "suites": entries,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if report["counts"]["broken"] or report["counts"]["error"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(batch)
@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import glob
+import time
+import resource
+import threading
+import statistics
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import typer
+import yaml
+from abi import compile_contract
+from memory import current_rss_mb
+
+# Synthetic test files are generated there
+BENCH_DIR = ".fuzz_cache/bench"
+
+# Options toggled by the benchmark, the other options are read from the config file
+BENCH_OPTIONS = (
+    "swarm_testing",
+    "coverage_guidance",
+    "constants_mining",
+    "favor_long_sequence",
+)
+
+# Depth of the synthetic test file of the soak run, deep enough for its invariant to never break
+SOAK_DEPTH = 16
+
+SYNTHETIC_TEMPLATE = """pragma solidity 0.8.19;
+
+contract Synthetic {{
+    uint public step;
+{gates}
+}}
+
+contract SyntheticTest {{
+    Synthetic public target;
+
+    function setUp() public {{
+        target = new Synthetic();
+    }}
+
+    function invariant_gatesNotAllPassed() public returns (bool) {{
+        return target.step() < {depth};
+    }}
+}}
+"""
+
+GATE_TEMPLATE = """
+    function gate{i}(uint8 x) public {{
+        if (step == {i} && x >= {low} && x < {high}) step = {next};
+        else if (x == 0) step = 0;
+    }}
+"""
+
+
+def synthetic_contract(depth):
+    """Write a test file whose invariant breaks after `depth` gates were passed in order, return its path.
+
+    Each gate only lets a sixteenth of the values through, so that the
+    difficulty grows exponentially with the depth.
+    """
+    gates = ""
+    for i in range(depth):
+        low = (37 * i + 11) % 240 + 1
+        gates += GATE_TEMPLATE.format(i=i, low=low, high=low + 16, next=i + 1)
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    path = os.path.join(BENCH_DIR, f"synthetic_{depth}.sol")
+    with open(path, "w") as f:
+        f.write(SYNTHETIC_TEMPLATE.format(gates=gates, depth=depth))
+    return path
+
+
+def combinations(conf, full):
+    """Return the (name, option values) to benchmark.
+
+    By default the options of the config file are benchmarked along with each
+    option toggled on its own, with `full` every combination is benchmarked.
+    """
+    if full:
+        return [
+            (
+                ",".join(f"{opt}={int(v)}" for opt, v in zip(BENCH_OPTIONS, values)),
+                dict(zip(BENCH_OPTIONS, values)),
+            )
+            for values in itertools.product((False, True), repeat=len(BENCH_OPTIONS))
+        ]
+    combos = [("config", {})]
+    for opt in BENCH_OPTIONS:
+        combos.append((f"{opt}={int(not conf[opt])}", {opt: not conf[opt]}))
+    return combos
+
+
+def run_case(test_file_name, conf):
+    """Run a single campaign, meant to be run in a fresh process so that its peak RSS is its own."""
+    from fuzzer import run_campaign
+
+    stats = dict()
+    broken = run_campaign(
+        test_file_name, conf, conf["anvil_port"], conf["fuzz_runs"], stats=stats
+    )
+    stats["broken"] = broken
+    stats["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    stats["node_peak_rss_mb"] = (
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    )
+    return stats
+
+
+def soak_case(test_file_name, conf, interval):
+    """Run a campaign until its time budget runs out, sampling the RSS of the process every `interval` seconds.
+
+    Return the (elapsed seconds, RSS in MB) samples and the stats of the campaign.
+    """
+    from fuzzer import run_campaign
+
+    samples = []
+    done = threading.Event()
+    start = time.perf_counter()
+
+    def sample():
+        while not done.wait(interval):
+            samples.append((time.perf_counter() - start, current_rss_mb()))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    stats = dict()
+    try:
+        stats["broken"] = run_campaign(
+            test_file_name, conf, conf["anvil_port"], conf["fuzz_runs"], stats=stats
+        )
+    finally:
+        done.set()
+        sampler.join()
+    return samples, stats
+
+
+def rss_growth(samples):
+    """Relative growth of the RSS from the end of the warm-up (the first quarter of the run) to the end of the run."""
+    if len(samples) < 4:
+        return 0.0
+    warm = samples[len(samples) // 4][1]
+    end = max(rss for _, rss in samples[-(len(samples) // 4) :])
+    return (end - warm) / warm
+
+
+def soak(conf, duration, interval, output, tolerance):
+    """Run a long campaign which never breaks its invariant, and fail if the RSS of the fuzzer keeps climbing."""
+    test_file_name = synthetic_contract(SOAK_DEPTH)
+    compile_contract(test_file_name)
+    soak_conf = dict(conf, fuzz_runs=10**9, time_budget=duration, seed=0)
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        samples, stats = pool.submit(
+            soak_case, test_file_name, soak_conf, interval
+        ).result()
+    growth = rss_growth(samples)
+    report = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": soak_conf,
+        "stats": stats,
+        "rss_growth": growth,
+        "rss_mb": samples,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(
+        f"RSS {samples[0][1] if samples else 0:.0f}MB -> {samples[-1][1] if samples else 0:.0f}MB "
+        f"over {duration:.0f}s, {100 * growth:.1f}% growth after warm-up"
+    )
+    if growth > tolerance:
+        print(f"Regression: the RSS grew by more than {100 * tolerance:.0f}% after warm-up")
+        sys.exit(1)
+
+
+def summarize(runs):
+    """Aggregate the stats of the runs of a case, campaigns which did not break the invariants count as infinitely slow."""
+    times = [
+        run["time_to_failure"] if run["time_to_failure"] is not None else float("inf")
+        for run in runs
+    ]
+    median_time = statistics.median(times)
+    return {
+        "runs": len(runs),
+        "failures_found": sum(run["broken"] for run in runs),
+        "median_time_to_failure": None if median_time == float("inf") else median_time,
+        "execs_per_sec": statistics.median(
+            run["executions"] / run["duration"] for run in runs
+        ),
+        "rpcs_per_exec": statistics.median(
+            run["rpc_requests"] / max(run["executions"], 1) for run in runs
+        ),
+        # a JSON-RPC batch is a single round trip
+        "round_trips_per_exec": statistics.median(
+            run["rpc_round_trips"] / max(run["executions"], 1) for run in runs
+        ),
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        "node_peak_rss_mb": max(run["node_peak_rss_mb"] for run in runs),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of `results` with respect to `baseline` beyond a relative `tolerance`."""
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        base = baseline[case]
+        if base["median_time_to_failure"] is not None and (
+            result["median_time_to_failure"] is None
+            or result["median_time_to_failure"]
+            > base["median_time_to_failure"] * (1 + tolerance)
+        ):
+            regressions.append(
+                f"{case}: median time to failure {result['median_time_to_failure']} > {base['median_time_to_failure']:.2f}s"
+            )
+        if result["execs_per_sec"] < base["execs_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{case}: {result['execs_per_sec']:.1f} execs/s < {base['execs_per_sec']:.1f}"
+            )
+        if result["rpcs_per_exec"] > base["rpcs_per_exec"] * (1 + tolerance):
+            regressions.append(
+                f"{case}: {result['rpcs_per_exec']:.1f} RPCs/exec > {base['rpcs_per_exec']:.1f}"
+            )
+        # absent from the reports of older versions
+        if "round_trips_per_exec" in base and result[
+            "round_trips_per_exec"
+        ] > base["round_trips_per_exec"] * (1 + tolerance):
+            regressions.append(
+                f"{case}: {result['round_trips_per_exec']:.1f} round trips/exec > {base['round_trips_per_exec']:.1f}"
+            )
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(
+                f"{case}: peak RSS {result['peak_rss_mb']:.0f}MB > {base['peak_rss_mb']:.0f}MB"
+            )
+    return regressions
+
+
+def benchmark(
+    config_file: str = typer.Argument("config.yaml"),
+    tests: str = typer.Option("tests/*.sol", help="glob of the test files"),
+    synthetic: str = typer.Option(
+        "2,3,4", help="depths of the synthetic test files, empty for none"
+    ),
+    seeds: int = typer.Option(3, help="number of seeded runs per case"),
+    fuzz_runs: int = typer.Option(
+        0, help="fuzz_runs of each run, 0 to keep the config value"
+    ),
+    full: bool = typer.Option(False, help="benchmark every combination of the options"),
+    output: str = typer.Option("benchmark.json", help="JSON report"),
+    baseline: str = typer.Option("", help="JSON report to compare with"),
+    tolerance: float = typer.Option(0.1, help="relative tolerance of the comparison"),
+    soak_duration: float = typer.Option(
+        0, "--soak", help="run a soak test of that many seconds instead"
+    ),
+    soak_interval: float = typer.Option(10, help="seconds between two RSS samples"),
+    soak_output: str = typer.Option("soak.json", help="JSON report of the soak test"),
+):
+    """Measure time to first violation, execs/sec, RPCs per exec and peak RSS over the test files."""
+    with open(config_file, "rb") as f:
+        conf = yaml.safe_load(f.read())
+    if soak_duration:
+        conf["corpus_dir"] = None
+        soak(conf, soak_duration, soak_interval, soak_output, tolerance)
+        return
+    if fuzz_runs:
+        conf["fuzz_runs"] = fuzz_runs
+    conf["corpus_dir"] = None  # every run starts from scratch
+
+    test_files = sorted(glob.glob(tests))
+    for depth in filter(None, synthetic.split(",")):
+        test_files.append(synthetic_contract(int(depth)))
+
+    results = dict()
+    for test_file_name in test_files:
+        compile_contract(test_file_name)
+        for name, options in combinations(conf, full):
+            runs = []
+            for k in range(seeds):
+                case_conf = dict(conf, **options, seed=k)
+                # a fresh process per run, so that peak RSS and caches are not shared between runs
+                with ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context("spawn")
+                ) as pool:
+                    runs.append(
+                        pool.submit(run_case, test_file_name, case_conf).result()
+                    )
+            case = f"{os.path.basename(test_file_name)}|{name}"
+            results[case] = summarize(runs)
+            print(case, json.dumps(results[case]))
+
+    report = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": conf,
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f)["results"], tolerance)
+        for regression in regressions:
+            print("Regression:", regression)
+        if regressions:
+            sys.exit(1)
+        print("No regression with respect to", baseline)
+
+
+if __name__ == "__main__":
+    typer.run(benchmark)
@@ -0,0 +1,91 @@
+import os
+import json
+import hashlib
+
+
+class Corpus:
+    """Coverage-increasing sequences stored on disk, so that a campaign can resume where a previous one stopped.
+
+    Each sequence is stored in its own JSON file, named after its hash, as the
+    list of its (target address, calldata) calls along with the coverage map
+    slots it covers. Sequences do not depend on web3 or hypothesis objects, and
+    several workers can add sequences concurrently.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, calls, slots):
+        """Store a sequence of (function, calldata) calls and the coverage map slots it covers."""
+        raw_calls = [[func.address, data] for func, data in calls]
+        name = hashlib.sha1(json.dumps(raw_calls).encode()).hexdigest()
+        path = os.path.join(self.directory, f"{name}.json")
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"calls": raw_calls, "coverage": sorted(slots)}, f)
+        os.replace(tmp_path, path)
+
+    def entries(self):
+        """Yield (file name, entry) for every stored sequence."""
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    yield name, json.load(f)
+            except (OSError, ValueError):  # partially written or corrupted entry
+                continue
+
+    def load(self, fuzz_candidates):
+        """Return the stored sequences as lists of (function, calldata), mapping them to the current fuzz candidates.
+
+        Sequences calling a function which is not fuzzed anymore are skipped.
+        """
+        by_selector = {
+            (func.address.lower(), "0x" + func.selector.hex()): func
+            for func, _ in fuzz_candidates
+        }
+        sequences = []
+        for _, entry in self.entries():
+            calls = []
+            for address, data in entry["calls"]:
+                func = by_selector.get((address.lower(), data[:10]))
+                if func is None:
+                    break
+                calls.append((func, data))
+            else:
+                sequences.append(calls)
+        return sequences
+
+    def minimize(self):
+        """Keep the smallest set of sequences covering the same slots, shortest sequences first.
+
+        Return the number of removed sequences.
+        """
+        entries = sorted(
+            self.entries(), key=lambda item: (len(item[1]["calls"]), item[0])
+        )
+        to_cover = set()
+        for _, entry in entries:
+            to_cover.update(entry["coverage"])
+
+        # greedy set cover : repeatedly keep the sequence covering the most uncovered slots
+        kept = set()
+        remaining = {name: set(entry["coverage"]) for name, entry in entries}
+        while to_cover:
+            name = max(remaining, key=lambda n: len(remaining[n] & to_cover))
+            gained = remaining.pop(name) & to_cover
+            if not gained:
+                break
+            kept.add(name)
+            to_cover -= gained
+
+        removed = 0
+        for name, _ in entries:
+            if name not in kept:
+                os.remove(os.path.join(self.directory, name))
+                removed += 1
+        return removed
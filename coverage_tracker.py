@@ -0,0 +1,142 @@
+import numpy as np
+from collections import defaultdict
+from eth_utils import keccak
+from utils import PUSH1, PUSH32, strip_metadata
+
+# Size of the coverage map, coverage IDs are hashed into this many slots
+MAP_BITS = 16
+MAP_SIZE = 1 << MAP_BITS
+
+# Typecode of the arrays of map slots
+SLOT_TYPECODE = "H" if MAP_SIZE <= 1 << 16 else "I"
+
+# AFL-style bucketing of hit counts : 1, 2, 3, 4-7, 8-15, 16-31, 32-127, 128+
+COUNT_CLASS = np.zeros(256, dtype=np.uint8)
+for _count, _bucket in (
+    (1, 1),
+    (2, 2),
+    (3, 4),
+    (4, 8),
+    (8, 16),
+    (16, 32),
+    (32, 64),
+    (128, 128),
+):
+    COUNT_CLASS[_count:] = _bucket
+
+# What a coverage ID identifies in the executed code : a pc, or an edge taken by a jump (or entering the code)
+COVERAGE_KEYS = ("edge", "pc")
+
+# Source of the edge entering the code of a call frame
+ENTRY = 0xFFFF
+
+
+def code_id(code):
+    """Return a 32-bit identifier of a bytecode, the first 4 bytes of its keccak hash."""
+    return int.from_bytes(keccak(code)[:4], "big")
+
+
+def pack_id(code, source, pc):
+    """Pack a coverage ID into an integer : the code identifier, then the source of the edge (0 for a pc) and the pc, on 16 bits each."""
+    return (code << 32) | (source << 16) | pc
+
+
+def coverage_index(ID):
+    """Hash a packed coverage ID into a slot of the coverage map (Fibonacci hashing)."""
+    return ((ID * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (64 - MAP_BITS)
+
+
+def instruction_count(code):
+    """Return the number of instructions of a runtime bytecode, without its metadata."""
+    code = strip_metadata(code)
+    count = 0
+    i = 0
+    while i < len(code):
+        op = code[i]
+        i += 1 + (op - PUSH1 + 1 if PUSH1 <= op <= PUSH32 else 0)
+        count += 1
+    return count
+
+
+class ContractCoverage:
+    """The coverage IDs seen during a campaign, grouped by code, for the per-contract report.
+
+    Each code is identified by the hash of its bytecode, so that the coverage
+    of a contract deployed several times, or called by delegatecall, is
+    reported once.
+    """
+
+    def __init__(self, key="edge"):
+        self.key = key
+        self.ids = defaultdict(set)
+
+    def update(self, ids):
+        for ID in ids:
+            self.ids[ID >> 32].add(ID & 0xFFFFFFFF)
+
+    def report(self, names, instructions):
+        """Print the coverage of every code, labelled by `names` and compared with `instructions` (both by code identifier)."""
+        print(f"Coverage by contract ({self.key}s):")
+        for code, covered in sorted(
+            self.ids.items(), key=lambda item: len(item[1]), reverse=True
+        ):
+            label = names.get(code, f"code 0x{code:08x}")
+            line = f"  {label}: {len(covered)} {self.key}s"
+            if self.key == "pc" and instructions.get(code):
+                ratio = len(covered) / instructions[code]
+                line += f", {100 * ratio:.1f}% of the instructions"
+            print(line)
+
+
+class CoverageMap:
+    """Fixed-size map of the coverage of the campaign and the example in which each slot was first seen.
+
+    `update` takes the coverage of a sequence as a mapping from map slot to the
+    number of transactions of the sequence which hit it. A sequence is novel if
+    it reaches a hit-count bucket never seen before for one of its slots, so the
+    bookkeeping costs the same whatever the length of the campaign.
+
+    A single instance is shared by all the workers of a campaign (through a
+    multiprocessing manager when `workers > 1`), so that the coverage guidance
+    of every worker is driven by the coverage of the whole campaign.
+    """
+
+    def __init__(self):
+        self.hits = np.zeros(MAP_SIZE, dtype=np.uint32)
+        self.virgin = np.zeros(MAP_SIZE, dtype=np.uint8)
+        self.first_seen = np.zeros(MAP_SIZE, dtype=np.int64)
+        self.num_examples = 0
+        self.current_max = 0
+
+    def update(self, seq_cov):
+        """Record the coverage of a sequence.
+
+        Return the value to target (None if there is none) and whether the sequence is novel.
+        """
+        self.num_examples += 1
+        if len(seq_cov) == 0:  # to avoid rare flakiness bug in hypothesis
+            return None, False
+        idx = np.fromiter(seq_cov.keys(), dtype=np.int64, count=len(seq_cov))
+        counts = np.fromiter(seq_cov.values(), dtype=np.int64, count=len(seq_cov))
+        self.hits[idx] += 1
+        classes = COUNT_CLASS[np.minimum(counts, 255)]
+        novel = (self.virgin[idx] & classes) == 0
+        if novel.any():  # new path discovered
+            self.virgin[idx] |= classes
+            self.first_seen[idx[novel]] = self.num_examples
+            self.current_max = self.num_examples
+            return self.num_examples, True
+        max_value = int(self.first_seen[idx].max())
+        if self.current_max == max_value:
+            return self.num_examples, False
+        return max_value, False
+
+    def rarity(self, slots):
+        """Mean over `slots` of the inverse of the number of examples which hit them, 1 for the rarest slots."""
+        idx = np.fromiter(slots, dtype=np.int64)
+        if len(idx) == 0:
+            return 0.0
+        return float(np.mean(1.0 / np.maximum(self.hits[idx], 1)))
+
+    def size(self):
+        return int(np.count_nonzero(self.hits))
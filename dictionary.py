@@ -0,0 +1,31 @@
+class ValueDictionary:
+    """Bounded, deduplicated set of 256-bit words seen at runtime, such as comparison operands.
+
+    Values are only appended, and are never evicted once the dictionary is
+    full, so that the i-th value stays the same for the whole campaign and a
+    Hypothesis example drawing it can be replayed and shrunk.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.values = []
+        self.seen = set()
+
+    def add(self, value):
+        if len(self.values) >= self.capacity or value in self.seen:
+            return
+        self.seen.add(value)
+        self.values.append(value)
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def get(self, i):
+        """Return the i-th value, None if there are not that many values yet."""
+        if i < len(self.values):
+            return self.values[i]
+        return None
+
+    def __len__(self):
+        return len(self.values)
@@ -0,0 +1,739 @@
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from eth_account import Account
+from web3._utils.method_formatters import BlockNotFound
+from collections import Counter
+from rpc import RPCClient, RPCException, AsyncRPCClient, response_result
+from snapshots import PrefixSnapshots, prefix_key
+from backend import AnvilBackend
+from stats import Stats
+from aggregator import AGGREGATOR_ADDRESS, aggregator_code, decode_mask
+from coverage_tracker import coverage_index
+
+# Gas limit and fees of every fuzzed transaction, set explicitly so that the node never estimates them
+TX_GAS_LIMIT = 15000000
+MAX_FEE_PER_GAS = 20000000000
+MAX_PRIORITY_FEE_PER_GAS = 1
+CHAIN_ID = 1
+
+SUBMISSION_MODES = ("unlocked", "raw", "web3")
+
+CHECK_POLICIES = ("every", "interval", "end", "storage")
+
+# Number of attempts for a request which raced the mining of the transaction
+RETRIES = 5
+
+
+def decode_bool(result):
+    return int(result[2:] or "0", 16) != 0
+
+
+class Executor:
+    """Send the fuzzed transactions to the node and check the invariants after each of them.
+
+    With `batch_rpc`, the transaction, its coverage trace and every invariant
+    call are sent as a single JSON-RPC batch. The trace and the invariant calls
+    are pinned to the block which will contain the transaction, so that they
+    can be sent before its hash is known, and are retried on their own if the
+    node processed them before mining the transaction.
+
+    `submission` selects how transactions are sent :
+    - `unlocked` : eth_sendTransaction from the unlocked anvil account, with the nonce, gas and fees filled locally
+    - `raw` : the transaction is signed locally and sent with eth_sendRawTransaction, its hash is known in advance
+    - `web3` : web3's `transact`, which fetches the nonce and estimates the gas and fees before sending
+    The nonce is tracked locally and restored along with the node snapshots.
+
+    With `aggregate_invariants`, all the invariants are checked by a single
+    eth_call to a generated contract injected with a state override, which
+    returns a bitmask of the broken invariants. The invariants then see that
+    contract as msg.sender, and the state written by the previous ones.
+
+    `check_policy` selects after which transactions the invariants are checked :
+    - `every` : after every transaction
+    - `interval` : every `check_interval` transactions
+    - `storage` : only after the transactions which wrote to the state
+    In every case the invariants are also checked after the last transaction
+    of the sequence, and `first_violation` bisects the transactions executed
+    since the last successful check to report an exact counterexample.
+
+    With `pipeline`, sequences are executed by an asyncio pipeline : each
+    transaction is sent as soon as the previous one was accepted by the node,
+    while the trace and the invariant checks of the previous ones, which are
+    pinned to their block, are still in flight or being decoded.
+
+    With a `contract_coverage`, the coverage IDs of the executed transactions
+    are also grouped by contract, for the report at the end of the campaign.
+    """
+
+    def __init__(
+        self,
+        w3,
+        rpc,
+        account,
+        invariants,
+        tracer,
+        coverage_guidance=True,
+        batch_rpc=True,
+        privkey=None,
+        submission="unlocked",
+        snapshot_cache=32,
+        snapshot_interval=4,
+        aggregate_invariants=False,
+        check_policy="every",
+        check_interval=10,
+        pipeline=False,
+        stats=None,
+        scheduler=None,
+        contract_coverage=None,
+    ):
+        if submission not in SUBMISSION_MODES:
+            raise ValueError(
+                f"tx_submission should be one of {', '.join(SUBMISSION_MODES)}"
+            )
+        if check_policy not in CHECK_POLICIES:
+            raise ValueError(
+                f"invariant_check should be one of {', '.join(CHECK_POLICIES)}"
+            )
+        self.w3 = w3
+        self.rpc = rpc
+        self.account = account
+        self.invariants = invariants
+        self.tracer = tracer
+        self.coverage_guidance = coverage_guidance
+        self.batch_rpc = batch_rpc
+        self.privkey = privkey
+        self.submission = submission
+        self.nonce = 0
+        self.trace_by_block = True
+        self.backend = AnvilBackend(w3, rpc, account, tracer)
+        self.snapshots = PrefixSnapshots(self.backend, snapshot_cache, snapshot_interval)
+        self.block_number = 0
+        self.check_policy = check_policy
+        self.check_interval = max(check_interval, 1)
+        self.last_checked = 0
+        self.need_trace = coverage_guidance or check_policy == "storage"
+        self.stats = stats if stats is not None else Stats()
+        self.scheduler = scheduler
+        self.contract_coverage = contract_coverage
+        self.pipeline = pipeline and submission != "web3"
+        if self.pipeline:
+            self.arpc = AsyncRPCClient(rpc.provider_url, rpc.timeout, self.stats)
+            self.loop = asyncio.new_event_loop()
+            # blocking tracers run in a single thread, with their own synchronous client (and stats, which are not thread-safe)
+            self.blocking = ThreadPoolExecutor(max_workers=1)
+            self.blocking_rpc = RPCClient(rpc.provider_url, rpc.timeout)
+            self.blocking_tracer = tracer.with_client(self.blocking_rpc)
+        self.invariant_calls = [
+            {"from": account, "to": inv.address, "data": inv.calldata()}
+            for inv in invariants
+        ]
+        self.aggregate = aggregate_invariants and len(invariants) > 1
+        if self.aggregate:
+            self.aggregator_call = {"from": account, "to": AGGREGATOR_ADDRESS}
+            self.aggregator_override = {
+                AGGREGATOR_ADDRESS: {"code": aggregator_code(invariants)}
+            }
+
+    def close(self):
+        """Shut down the pipeline : its HTTP session, event loop and thread."""
+        if self.pipeline:
+            self.loop.run_until_complete(self.arpc.close())
+            self.loop.close()
+            self.blocking.shutdown()
+            self.blocking_rpc.session.close()
+            self.pipeline = False
+
+    def restore(self, calls):
+        """Revert the node to the deepest cached state of the sequence of (function, calldata) `calls`.
+
+        Return the number of calls already executed in that state and the coverage they produced.
+        """
+        root_state = None
+        if len(self.snapshots.path) == 0:
+            root_state = self._root_state()
+        with self.stats.stage("snapshot"):
+            entry = self.snapshots.restore(calls, root_state)
+        self.nonce, self.block_number, self.last_checked = entry.state
+        if entry.coverage is None:
+            return entry.depth, Counter()
+        return entry.depth, entry.coverage.copy()
+
+    def checkpoint(self, depth, coverage):
+        """To be called once the first `depth` calls of the sequence were executed without breaking an invariant."""
+        self.snapshots.checkpoint(
+            depth, (self.nonce, self.block_number, self.last_checked), coverage
+        )
+
+    def _root_state(self):
+        return (
+            self._fetch_nonce(),
+            int(self.rpc.request("eth_blockNumber", []), 16),
+            0,
+        )
+
+    def _fetch_nonce(self):
+        return int(
+            self.rpc.request("eth_getTransactionCount", [self.account, "pending"]), 16
+        )
+
+    def _send_call(self, to, data):
+        """Build the request sending a transaction, return it with the transaction hash if it is known in advance."""
+        if self.submission == "raw":
+            signed = Account.sign_transaction(
+                {
+                    "nonce": self.nonce,
+                    "maxFeePerGas": MAX_FEE_PER_GAS,
+                    "maxPriorityFeePerGas": MAX_PRIORITY_FEE_PER_GAS,
+                    "gas": TX_GAS_LIMIT,
+                    "to": to,
+                    "data": data,
+                    "chainId": CHAIN_ID,
+                },
+                self.privkey,
+            )
+            return (
+                "eth_sendRawTransaction",
+                ["0x" + bytes(signed.rawTransaction).hex()],
+            ), "0x" + bytes(signed.hash).hex()
+        tx = {"from": self.account, "to": to, "data": data, "gas": hex(TX_GAS_LIMIT)}
+        if self.submission == "unlocked":
+            tx["nonce"] = hex(self.nonce)
+            tx["maxFeePerGas"] = hex(MAX_FEE_PER_GAS)
+            tx["maxPriorityFeePerGas"] = hex(MAX_PRIORITY_FEE_PER_GAS)
+        return ("eth_sendTransaction", [tx]), None
+
+    def _sent(self, response):
+        """Return the hash of a sent transaction and advance the local nonce and block number."""
+        try:
+            tx_hash = response_result(response)
+        except RPCException:
+            # the transaction was not included, the local nonce may be out of sync
+            self.nonce = self._fetch_nonce()
+            raise
+        self.nonce += 1
+        self.block_number += 1
+        return tx_hash
+
+    def run(self, calls):
+        """Execute a sequence of (function, calldata) `calls`, resuming from the deepest cached prefix.
+
+        Return the coverage of the sequence as a Counter of coverage map slots,
+        the depth of the transaction which broke the invariants (None if none
+        was broken) and the names of the broken invariants.
+        """
+        start, seq_cov = self.restore(calls)
+        if self.pipeline:
+            first, broken = self.loop.run_until_complete(
+                self._run_pipelined(calls, start, seq_cov)
+            )
+            if broken:
+                first, first_broken = self.first_violation(calls, first)
+                return seq_cov, first, first_broken or broken
+            return (seq_cov, *self._check_last(calls))
+        for depth in range(start, len(calls)):
+            coverage_ids, broken = self.execute(
+                *calls[depth], depth + 1, depth + 1 == len(calls)
+            )
+            self._cover(coverage_ids, seq_cov)
+            if broken:
+                first, first_broken = self.first_violation(calls, depth + 1)
+                return seq_cov, first, first_broken or broken
+            self.checkpoint(depth + 1, seq_cov)
+        # a cached prefix may have been resumed at a depth where the invariants were not checked
+        return (seq_cov, *self._check_last(calls))
+
+    def _check_last(self, calls):
+        """Check the invariants after the last of `calls` unless they already were, return the same as `first_violation` ((None, []) if they hold)."""
+        if self.last_checked >= len(calls):
+            return None, []
+        with self.stats.stage("invariants"):
+            broken = self.check_invariants(hex(self.block_number))
+        if not broken:
+            self.last_checked = len(calls)
+            return None, []
+        first, first_broken = self.first_violation(calls, len(calls))
+        return first, first_broken or broken
+
+    def begin(self):
+        """Start a sequence generated one call at a time : its calls are given to `extend`, then `finish` ends it.
+
+        Calls are not executed as long as the sequence follows the cached path
+        of prefix snapshots, which was executed without breaking the
+        invariants. Once it leaves the path, the node is reverted to the
+        deepest cached prefix and every call is executed as soon as it is
+        given, so that the sequence stops at the first violation.
+        """
+        self.steps = []
+        self.step_keys = [0]
+        self.executed = None  # number of executed calls, None while following the cached path
+        self.step_cov = Counter()
+
+    def extend(self, func, data):
+        """Append a call to the sequence, return the depth of the transaction which broke the invariants and their names."""
+        self.steps.append((func, data))
+        self.step_keys.append(prefix_key(self.step_keys[-1], func, data))
+        if self.executed is None:
+            if self.snapshots.follows(self.step_keys):
+                return None, []
+            return self._resume()
+        self.snapshots.extend(func, data)
+        return self._execute_steps()
+
+    def finish(self):
+        """End the sequence and check the invariants if needed, return the same as `run`."""
+        first, broken = None, []
+        if self.executed is None and self.steps:
+            first, broken = self._resume()
+        if not broken:
+            first, broken = self._check_last(self.steps)
+        return self.step_cov, first, broken
+
+    def _resume(self):
+        self.executed, self.step_cov = self.restore(self.steps)
+        return self._execute_steps()
+
+    def _execute_steps(self):
+        for depth in range(self.executed, len(self.steps)):
+            # the sequence may go on, the invariants are checked by `finish` after its last call
+            coverage_ids, broken = self.execute(*self.steps[depth], depth + 1, False)
+            self._cover(coverage_ids, self.step_cov)
+            self.executed = depth + 1
+            if broken:
+                first, first_broken = self.first_violation(self.steps, depth + 1)
+                return first, first_broken or broken
+            self.checkpoint(depth + 1, self.step_cov)
+        return None, []
+
+    def execute(self, func, data, depth=1, last=True):
+        """Execute the `depth`-th transaction of a sequence, calling `func` with the calldata `data`.
+
+        Return the coverage IDs of the transaction and the names of the broken
+        invariants, which is empty if the invariants were not checked.
+        """
+        check = self._planned_check(depth, last)
+        # a reverted transaction leaves the state unchanged, so the invariants checked right before it still hold
+        skippable = self.last_checked == depth - 1
+        # the check is deferred until the revert is known : always when tracing first costs nothing more,
+        # and in batches only for the functions which are expected to revert
+        deferred = (
+            bool(check)
+            and skippable
+            and self.need_trace
+            and (not self.batch_rpc or self._likely_reverts(func))
+        )
+        if deferred:
+            check = False
+        if self.batch_rpc:
+            ids, writes, reverted, broken = self._execute_batched(func, data, check)
+        else:
+            ids, writes, reverted, broken = self._execute_sequential(func, data, check)
+        self._record(func, reverted)
+        if reverted and skippable:
+            check = True
+        elif deferred or (check is None and writes):
+            with self.stats.stage("invariants"):
+                broken = self.check_invariants(hex(self.block_number))
+            check = True
+        if check and not broken:
+            self.last_checked = depth
+        return (ids if self.coverage_guidance else set()), broken
+
+    def _cover(self, ids, seq_cov):
+        """Add the coverage IDs of a transaction to the coverage of its sequence and to the per-contract coverage."""
+        seq_cov.update({coverage_index(ID) for ID in ids})
+        if self.contract_coverage is not None:
+            self.contract_coverage.update(ids)
+
+    def _record(self, func, reverted):
+        self.stats.record_transaction(func.name, reverted)
+        if self.scheduler is not None:
+            self.scheduler.record(func, reverted)
+
+    def _likely_reverts(self, func):
+        return self.scheduler is not None and self.scheduler.likely_reverts(func)
+
+    def _planned_check(self, depth, last):
+        """Whether the invariants must be checked after the `depth`-th transaction, None if it depends on its writes."""
+        if self.check_policy == "every" or last:
+            return True
+        elif self.check_policy == "interval":
+            return depth % self.check_interval == 0
+        elif self.check_policy == "storage":
+            return None  # decided once the transaction is traced
+        return False
+
+    async def _run_pipelined(self, calls, start, seq_cov):
+        """Execute `calls[start:]`, return the depth and the names of the broken invariants if any."""
+        pending = deque()
+        try:
+            for depth in range(start + 1, len(calls) + 1):
+                func, data = calls[depth - 1]
+                block = hex(self.block_number + 1)
+                send_call, _ = self._send_call(func.address, data)
+                tx_hash = self._sent((await self.arpc.batch([send_call]))[0])
+                check = self._planned_check(depth, depth == len(calls))
+                follow_up = asyncio.ensure_future(
+                    self._follow_up(tx_hash, func.address, block, check)
+                )
+                snapshotID = None
+                if self.snapshots.wants(depth):
+                    snapshotID = await self.arpc.request("evm_snapshot", [])
+                pending.append(
+                    (depth, func, follow_up, snapshotID, (self.nonce, self.block_number))
+                )
+
+                # process the transactions whose results arrived, in order
+                while pending and pending[0][2].done():
+                    broken = self._processed(pending.popleft(), seq_cov)
+                    if broken:
+                        return broken
+            while pending:
+                await pending[0][2]
+                broken = self._processed(pending.popleft(), seq_cov)
+                if broken:
+                    return broken
+            return None, []
+        finally:
+            for item in pending:
+                item[2].cancel()
+
+    def _processed(self, item, seq_cov):
+        """Account for the results of a pipelined transaction, return (depth, broken invariants) if it broke some."""
+        depth, func, follow_up, snapshotID, (nonce, block_number) = item
+        ids, writes, reverted, broken, check = follow_up.result()
+        self._record(func, reverted)
+        if self.coverage_guidance:
+            self._cover(ids, seq_cov)
+        if broken:
+            return depth, broken
+        if check or (reverted and self.last_checked == depth - 1):
+            self.last_checked = depth
+        if snapshotID is not None:
+            self.snapshots.add(depth, snapshotID, (nonce, block_number, self.last_checked), seq_cov)
+        return None
+
+    async def _follow_up(self, tx_hash, to, block, check):
+        """Trace a sent transaction and check the invariants at its block."""
+        requests = []
+        tracer = self.blocking_tracer
+        trace_in_batch = self.need_trace and tracer.mode == "js"
+        if trace_in_batch:
+            requests.append(
+                ("debug_traceTransaction", [tx_hash, tracer.tracer_options()])
+            )
+        if check:
+            requests += self._invariant_requests(block)
+        responses = (await self.arpc.batch(requests)) if requests else []
+
+        ids = set()
+        writes = True
+        reverted = None
+        if self.need_trace:
+            summary = None
+            if trace_in_batch:
+                trace = responses.pop(0)
+                if "error" not in trace:
+                    # the code of a new address is fetched with the synchronous client
+                    summary = await self.loop.run_in_executor(
+                        self.blocking, tracer.summarize, trace["result"], to
+                    )
+            if summary is None:
+                summary = await self.loop.run_in_executor(
+                    self.blocking, tracer.collect, tx_hash, to
+                )
+            ids, writes, reverted = summary
+
+        broken = []
+        if check:
+            broken = await self._broken_invariants_async(responses, block)
+        elif check is None and writes:
+            responses = await self.arpc.batch(self._invariant_requests(block))
+            broken = await self._broken_invariants_async(responses, block)
+            check = True
+        return ids, writes, reverted, broken, check
+
+    def check_invariants(self, block):
+        """Return the names of the invariants broken at `block` (a hex block number or tag)."""
+        return self._broken_invariants(
+            self.rpc.batch(self._invariant_requests(block)), block
+        )
+
+    def _send(self, func, data):
+        """Send a transaction on its own, return its hash."""
+        if self.submission == "web3":
+            tx = self.w3.eth.send_transaction(
+                {
+                    "from": self.account,
+                    "to": func.address,
+                    "data": data,
+                }
+            )
+            self.nonce += 1
+            self.block_number += 1
+            return tx
+        call, _ = self._send_call(func.address, data)
+        return self._sent(self.rpc.batch([call])[0])
+
+    def _execute_sequential(self, func, data, check):
+        ids = set()
+        writes = True
+        reverted = None
+        broken = []
+        try:
+            with self.stats.stage("send"):
+                tx = self._send(func, data)
+            if self.need_trace:
+                with self.stats.stage("trace"):
+                    ids, writes, reverted = self.tracer.collect(tx, func.address)
+            if check:
+                with self.stats.stage("invariants"):
+                    broken = self.check_invariants(hex(self.block_number))
+        except (BlockNotFound):  # to avoid rare error when anvil fails to detect last block
+            pass
+        return ids, writes, reverted, broken
+
+    def _execute_batched(self, func, data, check):
+        block = hex(self.block_number + 1)
+        send_call, known_hash = self._send_call(func.address, data)
+        calls = [send_call]
+        trace_in_batch = self.need_trace and self.tracer.mode == "js"
+        if trace_in_batch and known_hash is not None:
+            calls.append(
+                ("debug_traceTransaction", [known_hash, self.tracer.tracer_options()])
+            )
+        elif trace_in_batch and self.trace_by_block:
+            calls.append(
+                ("debug_traceBlockByNumber", [block, self.tracer.tracer_options()])
+            )
+        else:
+            trace_in_batch = False
+        if check:
+            calls += self._invariant_requests(block)
+
+        with self.stats.stage("batch"):
+            responses = self.rpc.batch(calls)
+        tx_hash = self._sent(responses[0])
+        responses = responses[1:]
+
+        ids = set()
+        writes = True
+        reverted = None
+        if self.need_trace:
+            summary = None
+            if trace_in_batch:
+                trace = responses.pop(0)
+                if "error" not in trace and known_hash is not None:
+                    summary = self.tracer.summarize(trace["result"], func.address)
+                elif "error" not in trace and len(trace["result"]) > 0:
+                    result = trace["result"][0]
+                    if "result" in result:
+                        result = result["result"]
+                    summary = self.tracer.summarize(result, func.address)
+                elif (
+                    known_hash is None
+                    and "error" in trace
+                    and "not found" not in str(trace["error"]).lower()
+                ):
+                    # the node does not support block tracing, trace by hash from now on
+                    self.trace_by_block = False
+            if summary is None:
+                with self.stats.stage("trace"):
+                    summary = self.tracer.collect(tx_hash, func.address)
+            ids, writes, reverted = summary
+
+        broken = []
+        if check:
+            broken = self._broken_invariants(responses, block)
+        return ids, writes, reverted, broken
+
+    def first_violation(self, calls, depth):
+        """Find the transaction which broke the invariants, when they were found broken after `depth` transactions.
+
+        The invariants held after `last_checked` transactions, bisect the
+        transactions in between by replaying them from snapshots. Return the
+        depth of a transaction after which the invariants are broken while they
+        held before it, and the names of the invariants it broke.
+        """
+        with self.stats.stage("bisect"):
+            return self._bisect(calls, depth)
+
+    def _bisect(self, calls, depth):
+        good, bad = self.last_checked, depth
+        broken = None
+        if bad - good > 1:
+            start, _ = self.restore(calls[:good])
+            for func, data in calls[start:good]:
+                self._send(func, data)
+            good_snapshot = self.backend.snapshot()
+            good_state = (self.nonce, self.block_number)
+            while bad - good > 1:
+                mid = (good + bad) // 2
+                for func, data in calls[good:mid]:
+                    self._send(func, data)
+                mid_broken = self.check_invariants(hex(self.block_number))
+                if mid_broken:
+                    bad, broken = mid, mid_broken
+                    self.backend.revert(good_snapshot)
+                    good_snapshot = self.backend.snapshot()
+                    self.nonce, self.block_number = good_state
+                else:
+                    good = mid
+                    good_snapshot = self.backend.snapshot()
+                    good_state = (self.nonce, self.block_number)
+        return bad, broken
+
+    def _invariant_requests(self, block):
+        if self.aggregate:
+            return [
+                (
+                    "eth_call",
+                    [self.aggregator_call, block, self.aggregator_override],
+                )
+            ]
+        return [("eth_call", [call, block]) for call in self.invariant_calls]
+
+    def _broken_invariants(self, responses, block):
+        """Decode the responses to the requests of `_invariant_requests`, return the names of the broken invariants."""
+        requests = self._invariant_requests(block)
+        if self.aggregate:
+            response = responses[0]
+            if "error" in response:
+                try:
+                    response = self._retry(*requests[0])
+                except RPCException:
+                    response = {"error": "state overrides not supported"}
+            if "error" not in response:
+                return decode_mask(response["result"], self.invariants)
+            # the node does not support state overrides, check invariants one by one from now on
+            self.aggregate = False
+            return self._broken_invariants(
+                self.rpc.batch(self._invariant_requests(block)), block
+            )
+
+        broken = []
+        for inv, request, response in zip(self.invariants, requests, responses):
+            if "error" in response:
+                response = self._retry(*request)
+            if "error" in response or not decode_bool(response["result"]):
+                broken.append(inv.name)
+        return broken
+
+    def _retry(self, method, params):
+        """Resend a request which may have been processed before the transaction was mined.
+
+        A reverting call is returned as is, any other error is retried.
+        """
+        for _ in range(RETRIES):
+            response = self.rpc.batch([(method, params)])[0]
+            if "error" not in response or "revert" in str(response["error"]).lower():
+                return response
+            time.sleep(0.01)
+        raise RPCException(response["error"])
+
+    async def _broken_invariants_async(self, responses, block):
+        """`_broken_invariants` for the pipeline, whose retries go through the asynchronous client."""
+        requests = self._invariant_requests(block)
+        if self.aggregate:
+            response = responses[0]
+            if "error" in response:
+                try:
+                    response = await self._retry_async(*requests[0])
+                except RPCException:
+                    response = {"error": "state overrides not supported"}
+            if "error" not in response:
+                return decode_mask(response["result"], self.invariants)
+            # the node does not support state overrides, check invariants one by one from now on
+            self.aggregate = False
+            return await self._broken_invariants_async(
+                await self.arpc.batch(self._invariant_requests(block)), block
+            )
+
+        broken = []
+        for inv, request, response in zip(self.invariants, requests, responses):
+            if "error" in response:
+                response = await self._retry_async(*request)
+            if "error" in response or not decode_bool(response["result"]):
+                broken.append(inv.name)
+        return broken
+
+    async def _retry_async(self, method, params):
+        for _ in range(RETRIES):
+            response = (await self.arpc.batch([(method, params)]))[0]
+            if "error" not in response or "revert" in str(response["error"]).lower():
+                return response
+            await asyncio.sleep(0.01)
+        raise RPCException(response["error"])
+
+
+class LocalExecutor(Executor):
+    """Execute the fuzzed sequences on an in-process backend, such as `PyEVMBackend`.
+
+    Sequences are run, cached and bisected exactly as by `Executor`, but
+    transactions and invariant calls are direct calls to the backend, so there
+    is nothing to batch, pipeline or pin to a block.
+    """
+
+    def __init__(
+        self,
+        backend,
+        invariants,
+        coverage_guidance=True,
+        snapshot_cache=32,
+        snapshot_interval=4,
+        check_policy="every",
+        check_interval=10,
+        stats=None,
+        scheduler=None,
+        contract_coverage=None,
+    ):
+        if check_policy not in CHECK_POLICIES:
+            raise ValueError(
+                f"invariant_check should be one of {', '.join(CHECK_POLICIES)}"
+            )
+        self.backend = backend
+        self.stats = stats if stats is not None else Stats()
+        self.scheduler = scheduler
+        self.contract_coverage = contract_coverage
+        self.invariants = invariants
+        self.coverage_guidance = coverage_guidance
+        self.snapshots = PrefixSnapshots(backend, snapshot_cache, snapshot_interval)
+        self.nonce = 0
+        self.block_number = 0
+        self.check_policy = check_policy
+        self.check_interval = max(check_interval, 1)
+        self.last_checked = 0
+        self.pipeline = False
+        self.invariant_calls = [(inv.address, inv.calldata()) for inv in invariants]
+
+    def _root_state(self):
+        return (0, 0, 0)
+
+    def execute(self, func, data, depth=1, last=True):
+        check = self._planned_check(depth, last)
+        with self.stats.stage("send"):
+            success, ids, writes = self.backend.transact(func.address, data)
+        self._record(func, not success)
+        if check is None:
+            check = writes
+        broken = []
+        if not success and self.last_checked == depth - 1:
+            check = True  # the state is unchanged since the last check
+        elif check:
+            with self.stats.stage("invariants"):
+                broken = self.check_invariants(None)
+        if check and not broken:
+            self.last_checked = depth
+        return (ids if self.coverage_guidance else set()), broken
+
+    def check_invariants(self, block):
+        broken = []
+        for inv, (to, data) in zip(self.invariants, self.invariant_calls):
+            success, output = self.backend.call(to, data)
+            if not success or not int.from_bytes(output[-32:], "big"):
+                broken.append(inv.name)
+        return broken
+
+    def _send(self, func, data):
+        self.backend.transact(func.address, data)
@@ -1,24 +1,64 @@
+import gc
 import sys
 import os
 import random
 from datetime import timedelta
 from web3 import Web3, HTTPProvider, Account
-from web3._utils.method_formatters import BlockNotFound, TransactionNotFound
-from node import fixture_anvil
-from abi import get_abi_and_bytecode, get_abi_by_name
-from utils import augment_strategies_with_constants
-from hypothesis import given, settings, note, Phase, HealthCheck, target
-from hypothesis.stateful import RuleBasedStateMachine, rule, invariant, precondition
+from node import fixture_anvil, dump_state, load_state
+from abi import (
+    get_abi_and_bytecode,
+    get_abi_by_name,
+    compile_contract,
+    load_artifact,
+    CompilationException,
+    CompiledFunction,
+)
+from utils import augment_strategies_with_constants, mine_constants
+from hypothesis import given, settings, note, Phase, HealthCheck, target, seed
+from hypothesis.stateful import (
+    RuleBasedStateMachine,
+    rule,
+    initialize,
+    invariant,
+    precondition,
+    run_state_machine_as_test,
+)
 from hypothesis.core import Flaky
 from hypothesis import strategies as st
 from strategy import get_strategies
-from collections import Counter
-import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import SyncManager
+from coverage_tracker import (
+    CoverageMap,
+    ContractCoverage,
+    COVERAGE_KEYS,
+    code_id,
+    instruction_count,
+)
+from tracer import CoverageCollector
+from rpc import RPCClient, CountingHTTPProvider
+from executor import Executor, LocalExecutor
+from backend import BACKENDS, AnvilBackend, PyEVMBackend
+from corpus import Corpus
+from dictionary import ValueDictionary
+from stats import Stats
+from mutation import MutationEngine, SCHEDULERS
+from scheduling import RevertScheduler, weighted_one_of
+from shrinker import shrink_failure
+from memory import MemoryGuard, MemoryCeiling
 import typer
 import atexit
 import yaml
 import string
 import time
+import json
+
+
+# States of the node right after setUp, one per hash of the sources
+SETUP_STATE_DIR = ".fuzz_cache/states"
+
+# composite draws whole sequences of operations, stateful draws them one at a time
+ENGINES = ("composite", "stateful")
 
 
 class InvariantException(Exception):
@@ -33,49 +73,39 @@ class InvariantException(Exception):
     pass
 
 
-def deploy_contract(w3, anvil, contract_names, test_file_name):
-    """Deploy contract to the local anvil network."""
+def deploy_contract(backend, contract_names, test_file_name):
+    """Deploy the test contracts on an execution backend, run their setUp, and return the contracts to fuzz.
+
+    The contracts deployed by a setUp are found through the view functions of
+    the test contract which return a contract.
+    """
     abis, bytecodes = get_abi_and_bytecode(test_file_name)
+    w3 = Web3()  # only builds contract objects, never connects
     targets = []
-    deployed_abis = []
     for contract in contract_names:
         abi = abis[contract]
-        bytecode = bytecodes[contract]
-        signed_txn = w3.eth.account.sign_transaction(
-            dict(
-                nonce=w3.eth.get_transaction_count(anvil.eth_address),
-                maxFeePerGas=20000000000,
-                maxPriorityFeePerGas=1,
-                gas=15000000,
-                to=b"",
-                data="0x" + bytecode,
-                chainId=1,
-            ),
-            anvil.eth_privkey,
-        )
-        tx_hash = w3.eth.send_raw_transaction(signed_txn.rawTransaction)
-        time.sleep(
-            0.5
-        )  # to avoid rare connection error when deploying contracts to local node
-        address = w3.eth.get_transaction_receipt(tx_hash)["contractAddress"]
+        address = Web3.to_checksum_address(backend.deploy("0x" + bytecodes[contract]))
         target = w3.eth.contract(address, abi=abi)
 
         if "setUp" in target.functions:
-            # record which contracts are deployed
-            # remove this from functions to fuzz
-            func = target.functions["setUp"]
-            func().transact({"from": w3.eth.default_account.address})
+            setUp = [info for info in abi if info.get("name") == "setUp"][0]
+            success, _, _ = backend.transact(
+                address, CompiledFunction(address, dict(setUp)).calldata()
+            )
+            if not success:
+                raise Exception(f"setUp of {contract} reverted")
 
             # We only fuzz contracts that have setUp functions
-            for info in target.abi:
+            for info in abi:
                 if info["type"] == "function" and info["stateMutability"] == "view":
                     for ret in info["outputs"]:
                         internal_type = ret["internalType"]
-                        if internal_type.startswith("contract"):
-                            deployed = target.functions[info["name"]]().call(
-                                {"from": w3.eth.default_account.address}
-                            )
-
+                        if not internal_type.startswith("contract"):
+                            continue
+                        _, output = backend.call(
+                            address, CompiledFunction(address, dict(info)).calldata()
+                        )
+                        deployed = Web3.to_checksum_address(output[12:32])
                         # TODO Deal with edge that contract names are the same
                         contract_name = internal_type.split(" ")[1]
                         deployed_abi = get_abi_by_name(contract_name, test_file_name)
@@ -88,6 +118,88 @@ def deploy_contract(w3, anvil, contract_names, test_file_name):
     return targets
 
 
+def code_labels(test_file_name, targets, get_code):
+    """Return the names and the numbers of instructions of the compiled and deployed contracts, by code identifier.
+
+    Deployed contracts whose code differs from their compiled runtime bytecode,
+    because of immutables for instance, are named after their address.
+    """
+    names = dict()
+    instructions = dict()
+    runtime_bytecodes = load_artifact(test_file_name).runtime_bytecodes
+    for name, runtime_bytecode in runtime_bytecodes.items():
+        try:
+            code = bytes.fromhex(runtime_bytecode)
+        except ValueError:  # unlinked library placeholders
+            continue
+        if code:
+            names[code_id(code)] = name
+            instructions[code_id(code)] = instruction_count(code)
+    for target in targets:
+        code = get_code(target.address)
+        names.setdefault(code_id(code), target.address)
+        instructions.setdefault(code_id(code), instruction_count(code))
+    return names, instructions
+
+
+def setup_state_path(test_file_name):
+    # the artifact is named after the hash of the sources
+    artifact_name = os.path.basename(load_artifact(test_file_name).path)
+    return os.path.join(SETUP_STATE_DIR, artifact_name)
+
+
+def corpus_path(corpus_dir, test_file_name):
+    """Return the corpus directory of a test file, named after its path so that test files with the same name do not share it."""
+    name = os.path.splitext(os.path.relpath(test_file_name))[0]
+    return os.path.join(corpus_dir, name.replace(os.sep, "_"))
+
+
+def deploy_or_load_setup_state(w3, backend, contract_names, test_file_name):
+    """Deploy the contracts, or load the state saved after setUp by a previous campaign on the same sources."""
+    state_file = setup_state_path(test_file_name)
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            saved = json.load(f)
+        load_state(w3, saved["state"])
+        return [
+            w3.eth.contract(address=target["address"], abi=target["abi"])
+            for target in saved["targets"]
+        ]
+
+    targets = deploy_contract(backend, contract_names, test_file_name)
+    os.makedirs(SETUP_STATE_DIR, exist_ok=True)
+    # written aside then renamed, so that another process never loads a partial state
+    tmp_path = f"{state_file}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {
+                "state": dump_state(w3),
+                "targets": [
+                    {"address": target.address, "abi": target.abi}
+                    for target in targets
+                ],
+            },
+            f,
+        )
+    os.replace(tmp_path, state_file)
+    return targets
+
+
+def prepare_setup_state(test_file_name, anvil_port):
+    """Deploy the contracts on a temporary node and save the state after setUp, unless a previous campaign saved it."""
+    if os.path.exists(setup_state_path(test_file_name)):
+        return
+    anvil, proc = fixture_anvil(anvil_port)
+    try:
+        w3 = Web3(HTTPProvider(anvil.provider, request_kwargs={"timeout": 30}))
+        chain = AnvilBackend(w3, RPCClient(anvil.provider), anvil.eth_address)
+        contract_names, _ = get_strategies(test_file_name)
+        deploy_or_load_setup_state(w3, chain, contract_names, test_file_name)
+    finally:
+        proc.kill()
+        proc.wait()
+
+
 def collect_functions(contract_names, functions, targets):
     invariants = []
     fuzz_candidates = []
@@ -116,187 +228,590 @@ def collect_functions(contract_names, functions, targets):
             for target in targets:
                 if func_to_call in target.functions:
                     if is_invariant:
-                        invariants.append(target.functions[func_to_call])
+                        invariants.append(CompiledFunction(target.address, func))
                     else:
                         fuzz_candidates.append(
-                            (target.functions[func_to_call], func["strategy"])
+                            (CompiledFunction(target.address, func), func["strategy"])
                         )
 
     return invariants, fuzz_candidates
 
 
-def fuzz(test_file_name: str, config_file: str = typer.Argument("config.yaml")):
-    with open(config_file, "rb") as f:
-        conf = yaml.safe_load(f.read())
-    fuzz_runs = conf["fuzz_runs"]
+class CampaignStopped(BaseException):
+    """Another worker of the campaign broke an invariant, or the time budget ran out.
+
+    Derives from BaseException so that hypothesis lets it propagate instead of
+    treating it as a failing example to shrink.
+    """
+
+    pass
+
+
+class CampaignManager(SyncManager):
+    pass
+
+
+CampaignManager.register("CoverageMap", CoverageMap)
+
+
+def run_campaign(
+    test_file_name,
+    conf,
+    anvil_port,
+    fuzz_runs,
+    coverage=None,
+    stop_event=None,
+    node=None,
+    replay_corpus=True,
+    stats=None,
+):
+    """Run a fuzzing campaign, return True if an invariant was broken.
+
+    The campaign starts its own anvil node, unless a running `node` (for instance from an `AnvilPool`) is given.
+    With `replay_corpus`, the sequences of the corpus are replayed before fuzzing to restore the coverage.
+    If a `stats` dict is given, it is filled with the number of executed sequences and JSON-RPC
+    requests, the duration of the campaign and the time at which an invariant was broken.
+    """
+    started = time.perf_counter()
+    counters = {"executions": 0, "time_to_failure": None}
+    clients = []
+    engine = None
+    executor = None
     seq_len = conf["seq_len"]
     shrinking = conf["shrinking"]
+    shrinker = shrinking and conf.get("shrinker", True)
     swarm_testing = conf["swarm_testing"]
     constants_mining = conf["constants_mining"]
     coverage_guidance = conf["coverage_guidance"]
     favor_long_sequence = conf["favor_long_sequence"]
-    anvil_port = conf["anvil_port"]
-
-    try:
-        subprocess.Popen(
-            f"""crytic-compile --export-format standard {test_file_name}""",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-    except:
-        raise Exception
-        sys.exit(-1)
+    coverage_tracer = conf.get("coverage_tracer", "js")
+    coverage_key = conf.get("coverage_key", "edge")
+    if coverage_key not in COVERAGE_KEYS:
+        raise ValueError(f"coverage_key should be one of {', '.join(COVERAGE_KEYS)}")
+    batch_rpc = conf.get("batch_rpc", True)
+    tx_submission = conf.get("tx_submission", "unlocked")
+    snapshot_cache = conf.get("snapshot_cache", 32)
+    snapshot_interval = conf.get("snapshot_interval", 4)
+    save_setup_state = conf.get("save_setup_state", True)
+    aggregate_invariants = conf.get("aggregate_invariants", False)
+    invariant_check = conf.get("invariant_check", "every")
+    invariant_check_interval = conf.get("invariant_check_interval", 10)
+    corpus_dir = conf.get("corpus_dir")
+    pipeline = conf.get("pipeline", False)
+    backend = conf.get("backend", "anvil")
+    if backend not in BACKENDS:
+        raise ValueError(f"backend should be one of {', '.join(BACKENDS)}")
+    test_engine = conf.get("engine", "composite")
+    if test_engine not in ENGINES:
+        raise ValueError(f"engine should be one of {', '.join(ENGINES)}")
+    scheduler = conf.get("scheduler", "hypothesis")
+    if scheduler not in SCHEDULERS:
+        raise ValueError(f"scheduler should be one of {', '.join(SCHEDULERS)}")
+    hypothesis_runs = {"hypothesis": fuzz_runs, "both": fuzz_runs // 2, "power": 0}[
+        scheduler
+    ]
+    random_seed = conf.get("seed")
+    time_budget = conf.get("time_budget")
+    deadline = started + time_budget if time_budget else None
+    dictionary = None
+    if conf.get("dictionary", False):
+        dictionary = ValueDictionary(conf.get("dictionary_size", 4096))
+    memory_guard = MemoryGuard(conf.get("memory_limit"))
+    revert_scheduler = None
+    if conf.get("revert_scheduling", True):
+        revert_scheduler = RevertScheduler()
+    contract_coverage = None
+    if coverage_guidance:
+        contract_coverage = ContractCoverage(coverage_key)
+    labels = None
+    campaign_stats = Stats(
+        conf.get("stats", False),
+        conf.get("stats_interval", 10),
+        conf.get("stats_export"),
+    )
 
-    # Anvil node
-    anvil, proc = fixture_anvil(anvil_port)
+    # Anvil node, unless the contracts are executed in-process
+    proc = None
+    if backend == "anvil" and node is None:
+        anvil, proc = fixture_anvil(anvil_port)
+    elif backend == "anvil":
+        anvil, _ = node
 
     def exit_handler():
-        proc.kill()
-        proc.wait()
+        if proc is not None:
+            proc.kill()
+            proc.wait()
 
     atexit.register(
         exit_handler
     )  # closes the anvil node whenever the program stops (unexpectedly or not)
 
-    # Provider
-    w3 = Web3(HTTPProvider(anvil.provider, request_kwargs={"timeout": 30}))
-    w3.eth.default_account = Account.from_key(anvil.eth_privkey)
-    account = w3.eth.default_account.address
     try:
-        assert w3.isConnected()
-    except AttributeError:
-        assert w3.is_connected()
-    except:
-        sys.exit(-1)
-
-    contract_names, functions = get_strategies(test_file_name)
-    targets = deploy_contract(w3, anvil, contract_names, test_file_name)
-
-    os.remove(f"crytic-export/{test_file_name.split('/')[-1]}.json")
-
-    invariants, fuzz_candidates = collect_functions(contract_names, functions, targets)
-
-    if constants_mining:
-        fuzz_candidates = augment_strategies_with_constants(
-            test_file_name, fuzz_candidates
-        )
-
-    if shrinking:
-        phases_tuple = (
-            Phase.explicit,
-            Phase.reuse,
-            Phase.generate,
-            Phase.target,
-            Phase.shrink,
+        contract_names, functions = get_strategies(test_file_name)
+        if backend == "pyevm":
+            chain = PyEVMBackend(dictionary=dictionary, coverage_key=coverage_key)
+            targets = deploy_contract(chain, contract_names, test_file_name)
+        else:
+            # Provider
+            w3 = Web3(
+                CountingHTTPProvider(anvil.provider, request_kwargs={"timeout": 30})
+            )
+            clients.append(w3.provider)
+            w3.eth.default_account = Account.from_key(anvil.eth_privkey)
+            account = w3.eth.default_account.address
+            try:
+                assert w3.isConnected()
+            except AttributeError:
+                assert w3.is_connected()
+            except:
+                sys.exit(-1)
+
+            chain = AnvilBackend(w3, RPCClient(anvil.provider), account)
+            if save_setup_state:
+                targets = deploy_or_load_setup_state(
+                    w3, chain, contract_names, test_file_name
+                )
+            else:
+                targets = deploy_contract(chain, contract_names, test_file_name)
+
+        if contract_coverage is not None:
+            labels = code_labels(test_file_name, targets, chain.get_code)
+
+        invariants, fuzz_candidates = collect_functions(
+            contract_names, functions, targets
         )
-    else:
-        phases_tuple = (Phase.explicit, Phase.reuse, Phase.generate, Phase.target)
 
-    operations = [
-        st.tuples(st.just(fuzz_candidate[0]), fuzz_candidate[1])
-        for fuzz_candidate in fuzz_candidates
-    ]
-
-    @st.composite
-    def operations_list_strategy(draw):
-        # Generate a random subset of operations
-        if swarm_testing:
-            min_size_sampled = len(operations) - draw(
-                st.integers(0, len(operations) - 1)
+        constants = {"int": set(), "address": set(), "string": set(), "bytes": set()}
+        if constants_mining:
+            constants = mine_constants(test_file_name)
+        if constants_mining or dictionary is not None:
+            fuzz_candidates = augment_strategies_with_constants(
+                test_file_name, fuzz_candidates, constants, dictionary
             )
-            unique_operations = st.sets(
-                st.sampled_from(operations), min_size=min_size_sampled
+
+        if shrinking and not shrinker:
+            phases_tuple = (
+                Phase.explicit,
+                Phase.reuse,
+                Phase.generate,
+                Phase.target,
+                Phase.shrink,
             )
         else:
-            unique_operations = st.just(operations)
-        selected_operations = draw(unique_operations)
-        if favor_long_sequence:
-            min_seq_len_sampled = seq_len - draw(st.integers(0, seq_len - 1))
-        else:
-            min_seq_len_sampled = 1
-        selected_ops = st.lists(
-            st.one_of(selected_operations),
-            min_size=min_seq_len_sampled,
-            max_size=seq_len,
-        )
-        return draw(selected_ops)
-
-    CounterCoverage = Counter()
-    snapshotID = 0
-    num_examples = 0
-    current_max = 0
-    dico_first_seen = dict()
-
-    @settings(
-        max_examples=fuzz_runs,
-        phases=phases_tuple,
-        deadline=None,
-        suppress_health_check=list(HealthCheck),
-    )
-    @given(ops=operations_list_strategy())
-    def composite_test(ops):
-        seqCoverage = set()
-        nonlocal snapshotID
-        nonlocal num_examples
-        nonlocal current_max
-
-        def update_coverage_frequency(seqCov):
-            nonlocal current_max
-            if coverage_guidance:
-                CounterCoverage.update(seqCov)
-                covered_paths = [CounterCoverage[ID] for ID in seqCov]
-                if len(covered_paths) > 0:  # to avoid rare flakiness bug in hypothesis
-                    if 1 in covered_paths:  # new path discovered
-                        selected_IDs = [
-                            ID for ID, count in CounterCoverage.items() if count == 1
-                        ]
-                        for ID in selected_IDs:
-                            dico_first_seen[ID] = num_examples
-                        current_max = num_examples
-                        target(num_examples)
-                    else:
-                        selected_values = [dico_first_seen[ID] for ID in seqCov]
-                        max_value = max(selected_values)
-                        if current_max == max_value:
-                            target(num_examples)
-                        else:
-                            target(max_value)
-
-        if snapshotID == 0:
-            snapshotID = w3.provider.make_request("evm_snapshot", [])["result"]
+            phases_tuple = (Phase.explicit, Phase.reuse, Phase.generate, Phase.target)
+
+        operations = [
+            st.tuples(st.just(fuzz_candidate[0]), fuzz_candidate[1])
+            for fuzz_candidate in fuzz_candidates
+        ]
+
+        @st.composite
+        def operation_strategy(draw):
+            """Draw the subset of operations of a sequence, return the strategy of its operations."""
+            # Generate a random subset of operations
+            if swarm_testing:
+                min_size_sampled = len(operations) - draw(
+                    st.integers(0, len(operations) - 1)
+                )
+                unique_operations = st.sets(
+                    st.sampled_from(operations), min_size=min_size_sampled
+                )
+            else:
+                unique_operations = st.just(operations)
+            selected_operations = draw(unique_operations)
+            if revert_scheduler is not None:
+                # in the order of `operations`, so that the choices can be replayed
+                selected = [
+                    i for i, op in enumerate(operations) if op in selected_operations
+                ]
+                return weighted_one_of(
+                    revert_scheduler,
+                    [operations[i] for i in selected],
+                    [fuzz_candidates[i][0] for i in selected],
+                )
+            return st.one_of(selected_operations)
+
+        @st.composite
+        def operations_list_strategy(draw):
+            operation = draw(operation_strategy())
+            if favor_long_sequence:
+                min_seq_len_sampled = seq_len - draw(st.integers(0, seq_len - 1))
+            else:
+                min_seq_len_sampled = 1
+            selected_ops = st.lists(
+                operation,
+                min_size=min_seq_len_sampled,
+                max_size=seq_len,
+            )
+            return draw(selected_ops)
+
+        if coverage is None:
+            coverage = CoverageMap()
+        campaign_stats.coverage = coverage
+        if backend == "pyevm":
+            executor = LocalExecutor(
+                chain,
+                invariants,
+                coverage_guidance,
+                snapshot_cache,
+                snapshot_interval,
+                invariant_check,
+                invariant_check_interval,
+                campaign_stats,
+                revert_scheduler,
+                contract_coverage,
+            )
         else:
-            w3.provider.make_request("evm_revert", [snapshotID])
-            snapshotID = w3.provider.make_request("evm_snapshot", [])["result"]
-        num_examples += 1
-        for op in ops:
-            func = op[0]
+            rpc = RPCClient(anvil.provider, stats=campaign_stats)
+            clients.append(rpc)
+            tracer = CoverageCollector(
+                w3, rpc, coverage_tracer, dictionary, coverage_key
+            )
+            executor = Executor(
+                w3,
+                rpc,
+                account,
+                invariants,
+                tracer,
+                coverage_guidance,
+                batch_rpc,
+                anvil.eth_privkey,
+                tx_submission,
+                snapshot_cache,
+                snapshot_interval,
+                aggregate_invariants,
+                invariant_check,
+                invariant_check_interval,
+                pipeline,
+                campaign_stats,
+                revert_scheduler,
+                contract_coverage,
+            )
+            if executor.pipeline:
+                clients += [executor.arpc, executor.blocking_rpc]
+        found_failure = False
+        hypothesis_failure = dict()
+
+        def failed():
+            if counters["time_to_failure"] is None:
+                counters["time_to_failure"] = time.perf_counter() - started
+
+        def shrink(calls, broken):
+            if not shrinker:
+                return
+            start = time.perf_counter()
             try:
-                tx = func(op[1]).transact({"from": account})
+                with campaign_stats.stage("shrink"):
+                    calls, first, broken = shrink_failure(
+                        executor, calls, broken, constants["int"], conf, anvil_port
+                    )
+            except Exception as e:
+                # the violation is reported anyway, unshrunk
+                print(f"Shrinking failed ({type(e).__name__}: {e}), unshrunk sequence:")
+                for func, data in calls:
+                    print(f"  {func.name} {data}")
+                return
+            print(
+                f"Shrunk in {time.perf_counter() - start:.1f}s to {first} transactions breaking {', '.join(broken)}:"
+            )
+            for func, data in calls:
+                print(f"  {func.name} {data}")
+
+        corpus = None
+        if corpus_dir:
+            corpus = Corpus(corpus_path(corpus_dir, test_file_name))
+
+        if scheduler != "hypothesis":
+            engine = MutationEngine(
+                executor,
+                coverage,
+                fuzz_candidates,
+                seq_len,
+                constants["int"],
+                corpus,
+                random_seed,
+                dictionary,
+                memory_guard,
+            )
+
+        if corpus is not None and replay_corpus:
+            for calls in corpus.load(fuzz_candidates):
+                start = time.perf_counter()
+                seqCoverage, first, broken = executor.run(calls)
+                counters["executions"] += 1
+                if broken:
+                    failed()
+                    if stop_event is not None:
+                        stop_event.set()
+                    print(
+                        f"Broken invariants: {', '.join(broken)}, after transaction {first} of corpus sequence {calls[:first]}"
+                    )
+                    shrink(calls[:first], broken)
+                    return True
                 if coverage_guidance:
-                    structLogs = w3.provider.make_request(
-                        "debug_traceTransaction",
-                        [tx.hex(), {"disableStorage": True, "disableStack": True}],
-                    )["result"]["structLogs"]
-                    structLogs_filtered = [
-                        ele["pc"] for ele in structLogs if ele["depth"] == 1
-                    ]
-                    seqCoverage.update(set(structLogs_filtered))
-                for inv in invariants:
-                    result = inv().call({"from": account})
-                    assert result
-            except (
-                BlockNotFound
-            ):  # to avoid rare error when anvil fails to detect last block
-                pass
-
-        update_coverage_frequency(seqCoverage)
+                    _, novel = coverage.update(seqCoverage)
+                    if novel and engine is not None:
+                        engine.add(
+                            calls, seqCoverage.keys(), time.perf_counter() - start
+                        )
+
+        def update_coverage_frequency(seqCov, calls, exec_time):
+            if coverage_guidance:
+                value, novel = coverage.update(seqCov)
+                if value is not None:
+                    target(value)
+                if novel and corpus is not None:
+                    corpus.add(calls, seqCov.keys())
+                if novel and engine is not None:
+                    engine.add(calls, seqCov.keys(), exec_time)
+
+        def check_stopped():
+            # the worker which broke an invariant keeps running to shrink its counter-example
+            if not found_failure and (
+                (stop_event is not None and stop_event.is_set())
+                or (deadline is not None and time.perf_counter() > deadline)
+            ):
+                raise CampaignStopped
+
+        def example_started():
+            start = time.perf_counter()
+            if campaign_stats.enabled:
+                # time spent by hypothesis since the end of the previous example
+                campaign_stats.add_time("hypothesis", start - counters["last_end"])
+            return start
+
+        def example_broke(calls, first, broken, culprit):
+            nonlocal found_failure
+            counters["executions"] += 1
+            campaign_stats.record_execution()
+            failed()
+            found_failure = True
+            if revert_scheduler is not None:
+                # the counter-example is shrunk with the weights it was found with
+                revert_scheduler.frozen = True
+            if stop_event is not None:
+                stop_event.set()
+            note(
+                f"Broken invariants: {', '.join(broken)}, after transaction {first}: {culprit}"
+            )
+            hypothesis_failure["calls"] = calls[:first]
+            hypothesis_failure["broken"] = broken
+
+        def example_passed(seqCoverage, calls, start):
+            exec_time = time.perf_counter() - start
+            counters["executions"] += 1
+            campaign_stats.record_execution()
+            with campaign_stats.stage("coverage"):
+                update_coverage_frequency(seqCoverage, calls, exec_time)
+            if not found_failure and memory_guard.exceeded():
+                if engine is not None:
+                    engine.evict()
+                gc.collect()
+                if memory_guard.exceeded(force=True):
+                    raise MemoryCeiling
+            counters["last_end"] = time.perf_counter()
+
+        def composite_test(ops):
+            check_stopped()
+            start = example_started()
+            with campaign_stats.stage("encode"):
+                calls = [(op[0], op[0].calldata(op[1])) for op in ops]
+            with campaign_stats.stage("execute"):
+                seqCoverage, first, broken = executor.run(calls)
+            if broken:
+                example_broke(calls, first, broken, ops[first - 1])
+            assert not broken
+            example_passed(seqCoverage, calls, start)
+
+        class StatefulTest(RuleBasedStateMachine):
+            """Generate a sequence one call at a time, checking the invariants as it goes.
+
+            The sequence stops at the first transaction which breaks them, and
+            its prefixes are resumed from the snapshots of the executor.
+            """
+
+            def __init__(self):
+                super().__init__()
+                check_stopped()
+                self.start = example_started()
+                self.operation = None
+                self.broken = False
+                executor.begin()
+
+            @initialize(operation=operation_strategy())
+            def select_operations(self, operation):
+                self.operation = operation
+
+            @rule(data=st.data())
+            def call(self, data):
+                func, args = data.draw(self.operation)
+                with campaign_stats.stage("encode"):
+                    calldata = func.calldata(args)
+                with campaign_stats.stage("execute"):
+                    first, broken = executor.extend(func, calldata)
+                if broken:
+                    self.broken = True
+                    self.broke(first, broken)
+                assert not broken
+
+            def broke(self, first, broken):
+                func, calldata = executor.steps[first - 1]
+                example_broke(executor.steps, first, broken, f"{func.name} {calldata}")
+
+            def teardown(self):
+                if self.broken:
+                    return
+                with campaign_stats.stage("execute"):
+                    seqCoverage, first, broken = executor.finish()
+                if broken:
+                    self.broke(first, broken)
+                assert not broken
+                example_passed(seqCoverage, executor.steps, self.start)
+
+        def run_hypothesis(max_examples, round_number):
+            """Run hypothesis for `max_examples` examples, each round starting from a fresh hypothesis runner."""
+            hypothesis_settings = settings(
+                max_examples=max(max_examples, 1),
+                phases=phases_tuple,
+                deadline=None,
+                suppress_health_check=list(HealthCheck),
+                stateful_step_count=seq_len,
+            )
+            round_seed = None if random_seed is None else random_seed + round_number
+            counters["last_end"] = time.perf_counter()
+            if test_engine == "stateful":
+                if round_seed is not None:
+                    seed(round_seed)(StatefulTest)
+                run_state_machine_as_test(StatefulTest, settings=hypothesis_settings)
+            else:
+                test = given(ops=operations_list_strategy())(composite_test)
+                test = hypothesis_settings(test)
+                if round_seed is not None:
+                    test = seed(round_seed)(test)
+                test()
+
+        try:
+            remaining = hypothesis_runs
+            round_number = 0
+            while remaining > 0:
+                round_start = counters["executions"]
+                try:
+                    run_hypothesis(remaining, round_number)
+                    break
+                except MemoryCeiling:
+                    # hypothesis keeps a tree of the examples of its run, a new run starts without it
+                    memory_guard.restarts += 1
+                    remaining -= counters["executions"] - round_start
+                    round_number += 1
+        except AssertionError or Flaky:
+            if hypothesis_failure:
+                shrink(hypothesis_failure["calls"], hypothesis_failure["broken"])
+            return True
+        except CampaignStopped:
+            return False
+
+        if engine is not None:
+            failure = engine.run(fuzz_runs - hypothesis_runs, stop_event, deadline)
+            if failure is not None:
+                failed()
+                calls, first, broken = failure
+                if stop_event is not None:
+                    stop_event.set()
+                print(
+                    f"Broken invariants: {', '.join(broken)}, after transaction {first} of sequence {calls[:first]}"
+                )
+                shrink(calls[:first], broken)
+                return True
+        return False
+    finally:
+        if executor is not None:
+            executor.close()
+        exit_handler()
+        campaign_stats.print_stages()
+        if labels is not None and contract_coverage.ids:
+            contract_coverage.report(*labels)
+        if stats is not None:
+            stats["executions"] = counters["executions"] + (
+                engine.executions if engine is not None else 0
+            )
+            stats["rpc_requests"] = sum(client.request_id for client in clients)
+            stats["rpc_round_trips"] = sum(client.round_trips for client in clients)
+            stats["time_to_failure"] = counters["time_to_failure"]
+            stats["duration"] = time.perf_counter() - started
+            stats["memory_evictions"] = memory_guard.evictions
+            stats["hypothesis_restarts"] = memory_guard.restarts
+
+
+def _run_worker(
+    test_file_name, conf, anvil_port, fuzz_runs, coverage, stop_event, replay_corpus
+):
+    return run_campaign(
+        test_file_name,
+        conf,
+        anvil_port,
+        fuzz_runs,
+        coverage,
+        stop_event,
+        replay_corpus=replay_corpus,
+    )
+
+
+def run_parallel_campaign(test_file_name, conf, workers):
+    """Split the campaign across `workers` processes, each one with its own anvil node.
+
+    Workers share their coverage and the whole campaign stops as soon as one of them breaks an invariant.
+    """
+    fuzz_runs = conf["fuzz_runs"]
+    anvil_port = conf["anvil_port"]
+    if conf.get("backend", "anvil") == "anvil" and conf.get("save_setup_state", True):
+        # deployed once here, the workers all load the saved state
+        prepare_setup_state(test_file_name, anvil_port)
+    with CampaignManager() as manager:
+        coverage = manager.CoverageMap()
+        stop_event = manager.Event()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _run_worker,
+                    test_file_name,
+                    conf,
+                    anvil_port + k,
+                    fuzz_runs // workers + (k < fuzz_runs % workers),
+                    coverage,
+                    stop_event,
+                    k == 0,  # the coverage is shared, a single worker replays the corpus
+                )
+                for k in range(workers)
+            ]
+            results = [future.result() for future in futures]
+    return any(results)
+
+
+def fuzz(test_file_name: str, config_file: str = typer.Argument("config.yaml")):
+    with open(config_file, "rb") as f:
+        conf = yaml.safe_load(f.read())
+    fuzz_runs = conf["fuzz_runs"]
+    anvil_port = conf["anvil_port"]
+    workers = conf.get("workers", 1)
 
     try:
-        composite_test()
-        print("No problem found, no invariant was broken")
-    except AssertionError or Flaky:
+        compile_contract(test_file_name)
+    except CompilationException as e:
+        print(e)
+        sys.exit(-1)
+
+    if conf.get("corpus_dir") and conf.get("corpus_minimize", True):
+        Corpus(corpus_path(conf["corpus_dir"], test_file_name)).minimize()
+
+    if workers > 1:
+        broken = run_parallel_campaign(test_file_name, conf, workers)
+    else:
+        broken = run_campaign(test_file_name, conf, anvil_port, fuzz_runs)
+
+    if broken:
         print("Invariant broken")
+    else:
+        print("No problem found, no invariant was broken")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,48 @@
+import os
+import sys
+import resource
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# The resident set size is read every this many executions, reading it costs a system call
+CHECK_EVERY = 256
+
+
+def current_rss_mb():
+    """Return the current resident set size of the process in MB, its peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / 2**20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kB elsewhere
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+class MemoryCeiling(BaseException):
+    """The memory ceiling was reached and evicting the cold metadata did not bring the process below it.
+
+    Derives from BaseException so that hypothesis lets it propagate, the run
+    is then restarted without the bookkeeping hypothesis accumulated.
+    """
+
+    pass
+
+
+class MemoryGuard:
+    """Watch the resident set size of the process against a ceiling of `limit_mb` MB (no ceiling if None)."""
+
+    def __init__(self, limit_mb=None):
+        self.limit_mb = limit_mb
+        self.calls = 0
+        self.evictions = 0
+        self.restarts = 0
+
+    def exceeded(self, force=False):
+        """Whether the ceiling is exceeded, only measured every CHECK_EVERY calls unless `force`."""
+        if self.limit_mb is None:
+            return False
+        self.calls += 1
+        if not force and self.calls % CHECK_EVERY:
+            return False
+        return current_rss_mb() > self.limit_mb
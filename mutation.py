@@ -0,0 +1,280 @@
+import time
+import random
+import warnings
+import itertools
+from array import array
+from hypothesis.errors import NonInteractiveExampleWarning
+from coverage_tracker import SLOT_TYPECODE
+
+# Number of mutants generated from a seed each time it is picked, before and after scaling by its energy
+BASE_ENERGY = 8
+MIN_ENERGY = 1
+MAX_ENERGY = 64
+
+# Calldata kept per function to build inserted calls and fresh sequences
+POOL_EXAMPLES = 4
+POOL_SIZE = 32
+
+# Words tried when a word of the calldata is replaced
+INTERESTING_WORDS = (
+    0,
+    1,
+    2,
+    2**8 - 1,
+    2**16 - 1,
+    2**32 - 1,
+    2**64 - 1,
+    2**128 - 1,
+    2**255,
+    2**256 - 1,
+)
+
+SCHEDULERS = ("hypothesis", "power", "both")
+
+
+class Seed:
+    """A coverage-increasing sequence, packed into arrays to keep long campaigns small.
+
+    `functions` holds the index of the function of each call, `calldata` the
+    concatenated calldata of the calls, delimited by `offsets`, and `slots` the
+    coverage map slots the sequence covers.
+    """
+
+    __slots__ = (
+        "functions",
+        "offsets",
+        "calldata",
+        "slots",
+        "exec_time",
+        "fuzz_level",
+    )
+
+    def __init__(self, indices, calldatas, slots, exec_time):
+        self.functions = array("H", indices)
+        raw = [bytes.fromhex(data[2:]) for data in calldatas]
+        self.offsets = array(
+            "I", itertools.accumulate((len(r) for r in raw), initial=0)
+        )
+        self.calldata = b"".join(raw)
+        self.slots = array(SLOT_TYPECODE, slots)
+        self.exec_time = exec_time
+        self.fuzz_level = 0
+
+    def calls(self, functions):
+        """Unpack the sequence of (function, calldata), `functions` being indexed as when the seed was packed."""
+        return [
+            (
+                functions[f],
+                "0x" + self.calldata[self.offsets[k] : self.offsets[k + 1]].hex(),
+            )
+            for k, f in enumerate(self.functions)
+        ]
+
+
+class MutationEngine:
+    """Power-scheduled mutation of coverage-increasing sequences, an alternative to Hypothesis' `target()`.
+
+    Seeds are picked in turn, and each one is mutated as many times as its
+    energy, which follows AFL++ : it grows with the rarity of the coverage map
+    slots the seed covers, is higher for fast seeds and decays with the number
+    of times the seed was already fuzzed. Mutants stack up to 8 of the
+    following mutations : splice with another seed, insert, delete or
+    duplicate a call, and replace a word of the calldata of a call with a
+    mined constant, a value of the runtime dictionary, an interesting value or
+    a nearby value.
+    """
+
+    def __init__(
+        self,
+        executor,
+        coverage,
+        fuzz_candidates,
+        seq_len,
+        constants=(),
+        corpus=None,
+        seed=None,
+        dictionary=None,
+        memory_guard=None,
+    ):
+        self.executor = executor
+        self.coverage = coverage
+        self.seq_len = seq_len
+        self.constants = [c % 2**256 for c in constants]
+        self.corpus = corpus
+        self.dictionary = dictionary
+        self.memory_guard = memory_guard
+        self.rng = random.Random(seed)
+        self.seeds = []
+        self.cursor = 0
+        self.total_time = 0.0
+        self.executions = 0
+        self.pool = dict()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", NonInteractiveExampleWarning)
+            for func, strategy in fuzz_candidates:
+                self.pool[func] = [
+                    func.calldata(strategy.example()) for _ in range(POOL_EXAMPLES)
+                ]
+        self.functions = list(self.pool)
+        self.index = {func: i for i, func in enumerate(self.functions)}
+        self.mutators = (
+            self._splice,
+            self._insert,
+            self._delete,
+            self._duplicate,
+            self._replace_word,
+            self._replace_word,
+        )
+
+    def add(self, calls, slots, exec_time):
+        """Add a coverage-increasing sequence of (function, calldata) to the seeds."""
+        for func, _ in calls:
+            if func not in self.index:
+                self.index[func] = len(self.functions)
+                self.functions.append(func)
+        self.seeds.append(
+            Seed(
+                [self.index[func] for func, _ in calls],
+                [data for _, data in calls],
+                slots,
+                exec_time,
+            )
+        )
+        for func, data in calls:
+            pool = self.pool.setdefault(func, [])
+            if data not in pool:
+                if len(pool) >= POOL_SIZE:
+                    pool[self.rng.randrange(POOL_SIZE)] = data
+                else:
+                    pool.append(data)
+
+    def evict(self):
+        """Drop the half of the seeds with the lowest energy, the cold ones, to bound the memory of long campaigns."""
+        if len(self.seeds) < 2:
+            return
+        self.seeds.sort(key=self.energy, reverse=True)
+        del self.seeds[(len(self.seeds) + 1) // 2 :]
+        self.cursor = 0
+        if self.memory_guard is not None:
+            self.memory_guard.evictions += 1
+
+    def energy(self, seed):
+        mean_time = self.total_time / max(self.executions, 1)
+        speed = 1.0
+        if seed.exec_time and mean_time:
+            speed = min(max(mean_time / seed.exec_time, 0.25), 4.0)
+        rarity = self.coverage.rarity(seed.slots)
+        energy = BASE_ENERGY * speed * (1 + 15 * rarity) / (1 + seed.fuzz_level)
+        return int(min(max(energy, MIN_ENERGY), MAX_ENERGY))
+
+    def execute(self, calls):
+        """Execute a sequence, keep it as a seed if it is novel. Return (depth, broken invariants) if it broke some."""
+        start = time.perf_counter()
+        with self.executor.stats.stage("execute"):
+            seq_cov, first, broken = self.executor.run(calls)
+        elapsed = time.perf_counter() - start
+        self.executor.stats.record_execution()
+        self.total_time += elapsed
+        self.executions += 1
+        if broken:
+            return first, broken
+        with self.executor.stats.stage("coverage"):
+            _, novel = self.coverage.update(seq_cov)
+        if novel:
+            self.add(calls, seq_cov.keys(), elapsed)
+            if self.corpus is not None:
+                self.corpus.add(calls, seq_cov.keys())
+        if self.memory_guard is not None and self.memory_guard.exceeded():
+            self.evict()
+        return None
+
+    def run(self, executions, stop_event=None, deadline=None):
+        """Fuzz `executions` sequences, or until the `time.perf_counter()` `deadline`.
+
+        Return the failing sequence of (function, calldata), the depth of the
+        transaction which broke the invariants and their names, None if no
+        invariant was broken.
+        """
+        done = 0
+        while done < executions:
+            if self.seeds:
+                seed = self.seeds[self.cursor % len(self.seeds)]
+                self.cursor += 1
+                energy = self.energy(seed)
+                seed.fuzz_level += 1
+                mutants = (self.mutate(seed) for _ in range(energy))
+            else:
+                mutants = [self.random_sequence()]
+            for calls in mutants:
+                if done >= executions:
+                    return None
+                if stop_event is not None and stop_event.is_set():
+                    return None
+                if deadline is not None and time.perf_counter() > deadline:
+                    return None
+                done += 1
+                failure = self.execute(calls)
+                if failure is not None:
+                    return (calls, *failure)
+        return None
+
+    def random_sequence(self):
+        length = self.rng.randint(1, self.seq_len)
+        return [self._random_call() for _ in range(length)]
+
+    def mutate(self, seed):
+        calls = seed.calls(self.functions)
+        for _ in range(1 << self.rng.randint(0, 3)):
+            calls = self.rng.choice(self.mutators)(calls)
+        return calls[: self.seq_len] or seed.calls(self.functions)
+
+    def _random_call(self):
+        scheduler = self.executor.scheduler
+        if scheduler is None:
+            func = self.rng.choice(self.functions)
+        else:
+            weights = [scheduler.weight(f) for f in self.functions]
+            func = self.rng.choices(self.functions, weights)[0]
+        return func, self.rng.choice(self.pool[func])
+
+    def _splice(self, calls):
+        other = self.rng.choice(self.seeds).calls(self.functions)
+        cut = self.rng.randint(0, len(calls))
+        return calls[:cut] + other[self.rng.randint(0, len(other)) :]
+
+    def _insert(self, calls):
+        calls.insert(self.rng.randint(0, len(calls)), self._random_call())
+        return calls
+
+    def _delete(self, calls):
+        if len(calls) > 1:
+            del calls[self.rng.randrange(len(calls))]
+        return calls
+
+    def _duplicate(self, calls):
+        i = self.rng.randrange(len(calls))
+        calls.insert(i, calls[i])
+        return calls
+
+    def _replace_word(self, calls):
+        i = self.rng.randrange(len(calls))
+        func, data = calls[i]
+        num_words = (len(data) - 10) // 64
+        if num_words == 0:
+            return calls
+        w = self.rng.randrange(num_words)
+        start = 10 + 64 * w
+        word = int(data[start : start + 64], 16)
+        choice = self.rng.random()
+        if self.dictionary and choice < 0.2:
+            word = self.dictionary.get(self.rng.randrange(len(self.dictionary)))
+        elif self.constants and choice < 0.4:
+            word = self.rng.choice(self.constants)
+        elif choice < 0.7:
+            word = self.rng.choice(INTERESTING_WORDS)
+        elif choice < 0.9:
+            word = (word + self.rng.randint(-16, 16)) % 2**256
+        else:
+            word = self.rng.getrandbits(256)
+        calls[i] = func, data[:start] + f"{word:064x}" + data[start + 64 :]
+        return calls
@@ -1,8 +1,10 @@
 import sys
+import json
 import shutil
 from typing import Generator
 import subprocess
-from time import sleep
+from time import sleep, monotonic
+import requests
 
 
 class AnvilInstance:
@@ -12,6 +14,36 @@ class AnvilInstance:
         self.eth_privkey = eth_privkey
 
 
+class NodeException(Exception):
+    """The anvil node could not be started."""
+
+    pass
+
+
+def wait_for_node(provider: str, proc, timeout: float = 30.0):
+    """Poll the node over RPC until it answers, instead of sleeping a fixed time."""
+    payload = json.dumps(
+        {"jsonrpc": "2.0", "id": 1, "method": "eth_chainId", "params": []}
+    )
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        if proc.poll() is not None:
+            raise NodeException(f"anvil exited with code {proc.returncode}")
+        try:
+            response = requests.post(
+                provider,
+                data=payload,
+                headers={"Content-Type": "application/json"},
+                timeout=1,
+            )
+            if response.ok:
+                return
+        except requests.exceptions.ConnectionError:
+            pass
+        sleep(0.02)
+    raise NodeException(f"anvil did not answer on {provider} after {timeout}s")
+
+
 def fixture_anvil(port: int):
     """Fixture that runs anvil"""
     if not shutil.which("anvil"):
@@ -24,11 +56,75 @@ def fixture_anvil(port: int):
     eth_privkey = "0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80"
     eth = int(1e6)
     proc = subprocess.Popen(
-        f"""anvil --port {port} --chain-id 1 --accounts 3 --balance {eth} --steps-tracing""",
+        f"""exec anvil --port {port} --chain-id 1 --accounts 3 --balance {eth} --steps-tracing""",
         shell=True,
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
     )
 
-    sleep(3)
-    return AnvilInstance(f"http://127.0.0.1:{port}", eth_address, eth_privkey), proc
+    anvil = AnvilInstance(f"http://127.0.0.1:{port}", eth_address, eth_privkey)
+    wait_for_node(anvil.provider, proc)
+    return anvil, proc
+
+
+def dump_state(w3):
+    """Return the whole state of the node (accounts, code and storage)."""
+    return w3.provider.make_request("anvil_dumpState", [])["result"]
+
+
+def load_state(w3, state):
+    """Merge a state returned by `dump_state` into the node."""
+    response = w3.provider.make_request("anvil_loadState", [state])
+    if "error" in response:
+        raise NodeException(response["error"])
+
+
+class AnvilPool:
+    """Anvil nodes kept running between campaigns.
+
+    A released node is reset to a fresh chain with `anvil_reset` instead of
+    being killed, so that the next campaign does not pay the node startup.
+    """
+
+    def __init__(self, base_port: int):
+        self.next_port = base_port
+        self.idle = []
+        self.nodes = []
+
+    def acquire(self):
+        if self.idle:
+            return self.idle.pop()
+        node = fixture_anvil(self.next_port)
+        self.next_port += 1
+        self.nodes.append(node)
+        return node
+
+    def release(self, node):
+        anvil, proc = node
+        try:
+            response = requests.post(
+                anvil.provider,
+                data=json.dumps(
+                    {"jsonrpc": "2.0", "id": 1, "method": "anvil_reset", "params": []}
+                ),
+                headers={"Content-Type": "application/json"},
+                timeout=30,
+            )
+            response.raise_for_status()
+            # a failed reset is reported with HTTP 200 and an error member
+            reset = "error" not in response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            reset = False
+        if not reset:
+            proc.kill()
+            proc.wait()
+            self.nodes.remove(node)
+            return
+        self.idle.append(node)
+
+    def close(self):
+        for anvil, proc in self.nodes:
+            proc.kill()
+            proc.wait()
+        self.nodes = []
+        self.idle = []
@@ -0,0 +1,136 @@
+import json
+import aiohttp
+import requests
+from web3 import HTTPProvider
+from stats import Stats
+
+
+class RPCException(Exception):
+    """The node answered a JSON-RPC request with an error."""
+
+    pass
+
+
+def ordered_responses(responses, payloads):
+    if isinstance(responses, dict):  # the whole batch was rejected
+        raise RPCException(responses.get("error", responses))
+    by_id = {response["id"]: response for response in responses}
+    return [by_id[payload["id"]] for payload in payloads]
+
+
+def response_result(response):
+    if "error" in response:
+        raise RPCException(response["error"])
+    return response["result"]
+
+
+class RPCClient:
+    """Minimal JSON-RPC client over a persistent HTTP session, supporting batches.
+
+    web3's provider decodes, validates and formats every response, and only sends
+    one request per HTTP round trip : this client is used on the hot path instead.
+    """
+
+    def __init__(self, provider_url, timeout=30, stats=None):
+        self.provider_url = provider_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.request_id = 0
+        # HTTP requests sent, a batch of requests is a single round trip
+        self.round_trips = 0
+        self.stats = stats if stats is not None else Stats()
+
+    def payload(self, method, params):
+        self.request_id += 1
+        return {
+            "jsonrpc": "2.0",
+            "id": self.request_id,
+            "method": method,
+            "params": params,
+        }
+
+    def post(self, payload, stream=False):
+        self.round_trips += 1
+        with self.stats.stage("rpc"):
+            return self.session.post(
+                self.provider_url,
+                data=json.dumps(payload),
+                headers={"Content-Type": "application/json"},
+                stream=stream,
+                timeout=self.timeout,
+            )
+
+    def request(self, method, params):
+        return response_result(self.post(self.payload(method, params)).json())
+
+    def batch(self, calls):
+        """Send a list of (method, params) in a single round trip.
+
+        Return the raw responses (containing either `result` or `error`) in the order of `calls`.
+        """
+        payloads = [self.payload(method, params) for method, params in calls]
+        return ordered_responses(self.post(payloads).json(), payloads)
+
+
+class CountingHTTPProvider(HTTPProvider):
+    """web3's HTTP provider, counting its requests in `request_id` like `RPCClient`.
+
+    Requests made through web3 (receipts, the web3 submission mode, structLogs
+    traces) would otherwise be missing from the requests of a campaign.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request_id = 0
+        self.round_trips = 0
+
+    def make_request(self, method, params):
+        self.request_id += 1
+        self.round_trips += 1
+        return super().make_request(method, params)
+
+
+class AsyncRPCClient:
+    """asyncio counterpart of `RPCClient`, several requests can be in flight at the same time."""
+
+    def __init__(self, provider_url, timeout=30, stats=None):
+        self.provider_url = provider_url
+        self.timeout = timeout
+        self.session = None
+        self.request_id = 0
+        self.round_trips = 0
+        self.stats = stats if stats is not None else Stats()
+
+    def payload(self, method, params):
+        self.request_id += 1
+        return {
+            "jsonrpc": "2.0",
+            "id": self.request_id,
+            "method": method,
+            "params": params,
+        }
+
+    async def batch(self, calls):
+        # the session must be created from within the event loop
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        payloads = [self.payload(method, params) for method, params in calls]
+        self.round_trips += 1
+        with self.stats.stage("rpc"):
+            async with self.session.post(
+                self.provider_url,
+                data=json.dumps(payloads),
+                headers={"Content-Type": "application/json"},
+            ) as response:
+                responses = await response.json(content_type=None)
+        return ordered_responses(responses, payloads)
+
+    async def request(self, method, params):
+        return response_result((await self.batch([(method, params)]))[0])
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
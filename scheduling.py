@@ -0,0 +1,76 @@
+import math
+import bisect
+import itertools
+from collections import Counter
+from hypothesis import strategies as st
+
+# Lower bound of the sampling weight of a function, so that functions which always revert are still tried
+MIN_WEIGHT = 0.05
+
+# Tickets per unit of weight when drawing an operation, so that MIN_WEIGHT is worth one ticket
+TICKETS = 20
+
+# A function is expected to revert once it reverted this often over at least MIN_SAMPLES transactions
+REVERT_THRESHOLD = 0.9
+MIN_SAMPLES = 20
+
+
+class RevertScheduler:
+    """Adapt the sampling weights of the fuzzed functions to their revert rates, with a UCB1 bandit.
+
+    Functions are identified by (address, selector), i.e. by `CompiledFunction`.
+    A transaction which does not revert is rewarded : the weight of a function
+    is its success rate plus an exploration bonus which shrinks as it is tried,
+    so that functions guarded by access control or state preconditions get a
+    small share of the transactions instead of an equal one. Weights can be
+    frozen, so that Hypothesis replays and shrinks a failing example with the
+    same weights as when it was found.
+    """
+
+    def __init__(self):
+        self.tries = Counter()
+        self.reverts = Counter()
+        self.total = 0
+        self.frozen = False
+
+    def record(self, func, reverted):
+        """Record the outcome of a transaction calling `func`, `reverted` is None if it is not known."""
+        if reverted is None or self.frozen:
+            return
+        self.tries[func] += 1
+        self.reverts[func] += reverted
+        self.total += 1
+
+    def weight(self, func):
+        tries = self.tries[func]
+        if tries == 0:
+            return 1.0
+        success = 1 - self.reverts[func] / tries
+        bonus = math.sqrt(2 * math.log(self.total) / tries)
+        return min(max(success + bonus, MIN_WEIGHT), 1.0)
+
+    def likely_reverts(self, func):
+        tries = self.tries[func]
+        return tries >= MIN_SAMPLES and self.reverts[func] >= REVERT_THRESHOLD * tries
+
+
+def weighted_one_of(scheduler, operations, functions):
+    """Like `st.one_of(operations)`, choosing the i-th operation, which calls `functions[i]`, proportionally to its weight.
+
+    The weights are read at draw time, so the choice follows the revert rates as they are learned.
+    Each operation gets a number of tickets proportional to its weight, and a
+    ticket is drawn as a small integer : hypothesis draws those uniformly,
+    while its floats pile up near 0.
+    """
+
+    @st.composite
+    def weighted(draw):
+        cumulative = list(
+            itertools.accumulate(
+                max(round(scheduler.weight(func) * TICKETS), 1) for func in functions
+            )
+        )
+        ticket = draw(st.integers(0, cumulative[-1] - 1))
+        return draw(operations[bisect.bisect_right(cumulative, ticket)])
+
+    return weighted()
@@ -0,0 +1,204 @@
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from web3 import Web3, HTTPProvider
+from node import AnvilPool, dump_state, load_state
+from rpc import RPCClient
+from tracer import CoverageCollector
+from executor import Executor, LocalExecutor
+
+# The replica nodes of the shrinker of each worker listen from anvil_port + SHRINK_PORT_OFFSET, clear of the ports of the workers
+SHRINK_PORT_OFFSET = 100
+
+# Mined constants tried per calldata word, the smallest ones first
+MAX_WORD_CANDIDATES = 8
+
+
+class Shrinker:
+    """Shrink a sequence of (function, calldata) calls which breaks invariants, within a time budget.
+
+    Transactions are first removed by delta debugging (ddmin), then every
+    32-byte word of the calldata is simplified toward zero and the smaller
+    mined constants, until neither step makes progress. A candidate is kept
+    if it breaks one of the invariants broken by the original sequence, and
+    is truncated to the transaction which broke them. Candidates are checked
+    in parallel, one per executor, each executor being backed by its own
+    node ; among the candidates of a round, the first one in order of
+    preference wins, so that the result does not depend on the timing.
+    """
+
+    def __init__(self, executors, constants=(), timeout=60):
+        self.executors = executors
+        self.constants = sorted(c for c in constants if 0 < c < 2**256)
+        self.timeout = timeout
+        self.deadline = None
+        self.broken = set()
+        self.pool = None
+        self.candidates = 0
+        self.idle = queue.Queue()
+        for executor in executors:
+            self.idle.put(executor)
+
+    def shrink(self, calls, broken):
+        """Return the shrunk sequence, the depth of the violation and the broken invariants."""
+        self.deadline = time.monotonic() + self.timeout
+        self.broken = set(broken)
+        best = (list(calls), len(calls), list(broken))
+        with ThreadPoolExecutor(max_workers=len(self.executors)) as self.pool:
+            while not self._expired():
+                size = (len(best[0]), sum(len(data) for _, data in best[0]))
+                best = self._ddmin(best)
+                best = self._simplify_words(best)
+                if (len(best[0]), sum(len(data) for _, data in best[0])) == size:
+                    break
+        return best
+
+    def _expired(self):
+        return time.monotonic() > self.deadline
+
+    def _check(self, calls):
+        executor = self.idle.get()
+        try:
+            _, first, broken = executor.run(calls)
+        finally:
+            self.idle.put(executor)
+        if not self.broken.intersection(broken):
+            return None
+        return calls[:first], first, broken
+
+    def _first_failing(self, candidates):
+        """Check the candidates by rounds of one per executor, return the index and result of the first one which fails."""
+        width = len(self.executors)
+        for i in range(0, len(candidates), width):
+            if self._expired():
+                return None
+            self.candidates += len(candidates[i : i + width])
+            results = self.pool.map(self._check, candidates[i : i + width])
+            for k, result in enumerate(results):
+                if result is not None:
+                    return i + k, result
+        return None
+
+    def _ddmin(self, best):
+        n = 2
+        while len(best[0]) >= 2 and not self._expired():
+            calls = best[0]
+            n = min(n, len(calls))
+            bounds = [len(calls) * k // n for k in range(n + 1)]
+            chunks = [calls[bounds[k] : bounds[k + 1]] for k in range(n)]
+            complements = [
+                calls[: bounds[k]] + calls[bounds[k + 1] :] for k in range(n)
+            ]
+            # with two chunks, the complements are the chunks
+            candidates = chunks + (complements if n > 2 else [])
+            found = self._first_failing(candidates)
+            if found is not None:
+                index, best = found
+                n = 2 if index < n else max(n - 1, 2)
+            elif n >= len(calls):
+                break
+            else:
+                n = min(2 * n, len(calls))
+        return best
+
+    def _word_candidates(self, word):
+        if word == 0:
+            return
+        yield 0
+        for constant in self.constants[:MAX_WORD_CANDIDATES]:
+            if constant >= word:
+                break
+            yield constant
+
+    def _simplify_words(self, best):
+        i = 0
+        while i < len(best[0]) and not self._expired():
+            offset = 10  # "0x" and the selector, then 32-byte words
+            while offset + 64 <= len(best[0][i][1]) and not self._expired():
+                func, data = best[0][i]
+                candidates = []
+                word = int(data[offset : offset + 64], 16)
+                for value in self._word_candidates(word):
+                    calls = list(best[0])
+                    calls[i] = (
+                        func,
+                        data[:offset] + f"{value:064x}" + data[offset + 64 :],
+                    )
+                    candidates.append(calls)
+                found = self._first_failing(candidates)
+                if found is not None:
+                    best = found[1]
+                    if i >= len(best[0]):
+                        return best
+                offset += 64
+            i += 1
+        return best
+
+
+def replica_executors(executor, pool, count):
+    """Start `count` nodes from `pool` in the post-setUp state of the node of `executor`, return an executor for each.
+
+    The replicas do not collect coverage, they only check the invariants.
+    """
+    executor.restore([])
+    state = dump_state(executor.w3)
+    replicas = []
+    for _ in range(count):
+        anvil, _ = pool.acquire()
+        w3 = Web3(HTTPProvider(anvil.provider, request_kwargs={"timeout": 30}))
+        load_state(w3, state)
+        rpc = RPCClient(anvil.provider)
+        replicas.append(
+            Executor(
+                w3,
+                rpc,
+                executor.account,
+                executor.invariants,
+                CoverageCollector(
+                    w3, rpc, executor.tracer.mode, key=executor.tracer.key
+                ),
+                False,
+                executor.batch_rpc,
+                executor.privkey,
+                executor.submission,
+                executor.snapshots.capacity,
+                executor.snapshots.interval,
+                executor.aggregate,
+                executor.check_policy,
+                executor.check_interval,
+            )
+        )
+    return replicas
+
+
+def shrink_failure(executor, calls, broken, constants, conf, anvil_port):
+    """Shrink a sequence breaking invariants, on the node of `executor` and `shrink_nodes` - 1 replicas of it.
+
+    The shrunk sequence is replayed on `executor` itself before it is returned,
+    the original sequence is returned if it does not break the invariants there.
+    The in-process backend has no replicas, its candidates are checked one at a
+    time, as are those of a shrinker whose replicas could not be started.
+    """
+    nodes = conf.get("shrink_nodes", 4)
+    executors = [executor]
+    pool = None
+    if nodes > 1 and not isinstance(executor, LocalExecutor):
+        worker = anvil_port - conf["anvil_port"]
+        pool = AnvilPool(anvil_port + SHRINK_PORT_OFFSET + worker * (nodes - 1))
+    try:
+        if pool is not None:
+            try:
+                executors += replica_executors(executor, pool, nodes - 1)
+            except Exception as e:
+                print(
+                    f"Could not start the shrinking nodes ({e}), shrinking on a single node"
+                )
+        shrinker = Shrinker(executors, constants, conf.get("shrink_timeout", 60))
+        shrunk = shrinker.shrink(calls, broken)
+        _, first, confirmed = executor.run(shrunk[0])
+        if not set(broken).intersection(confirmed):
+            return calls, len(calls), broken
+        return shrunk[0][:first], first, confirmed
+    finally:
+        if pool is not None:
+            pool.close()
@@ -0,0 +1,96 @@
+class PrefixEntry:
+    __slots__ = ("key", "depth", "snapshotID", "state", "coverage")
+
+    def __init__(self, key, depth, snapshotID, state, coverage):
+        self.key = key
+        self.depth = depth
+        self.snapshotID = snapshotID
+        self.state = state
+        self.coverage = coverage
+
+
+def prefix_key(parent, func, data):
+    """Return the hash of a prefix, from the hash of the prefix without its last call `func` with calldata `data`."""
+    return hash((parent, func.address, data))
+
+
+def prefix_keys(calls):
+    """Return the hash of every prefix of a sequence of (function, calldata), the empty prefix included."""
+    keys = [0]
+    for func, data in calls:
+        keys.append(prefix_key(keys[-1], func, data))
+    return keys
+
+
+class PrefixSnapshots:
+    """Node snapshots taken after the prefixes of the last executed sequence.
+
+    Reverting the node to a snapshot deletes every snapshot taken after it, so
+    the cached snapshots always form a single path starting from the post-setUp
+    state. Snapshots are taken and reverted through an execution backend.
+    A new sequence resumes from the deepest snapshot of that path whose
+    prefix it shares, which is what happens most of the time during the reuse,
+    target and shrink phases. A snapshot is taken every `interval` transactions,
+    and at most `capacity` snapshots are kept to bound the memory of the node.
+    """
+
+    def __init__(self, backend, capacity=32, interval=4):
+        self.backend = backend
+        self.capacity = capacity
+        self.interval = max(interval, 1)
+        self.path = []
+        self.keys = [0]
+
+    def restore(self, calls, root_state):
+        """Revert the node to the deepest cached prefix of `calls`.
+
+        Return the cached entry holding its depth, the executor state and the sequence coverage at that point.
+        """
+        self.keys = prefix_keys(calls)
+        if len(self.path) == 0:
+            snapshotID = self.backend.snapshot()
+            self.path.append(PrefixEntry(0, 0, snapshotID, root_state, None))
+            return self.path[0]
+
+        j = 0
+        while (
+            j + 1 < len(self.path)
+            and self.path[j + 1].depth < len(self.keys)
+            and self.path[j + 1].key == self.keys[self.path[j + 1].depth]
+        ):
+            j += 1
+        entry = self.path[j]
+        self.backend.revert(entry.snapshotID)
+        entry.snapshotID = self.backend.snapshot()
+        del self.path[j + 1 :]
+        return entry
+
+    def follows(self, keys):
+        """Whether the cached path goes through the prefix whose hashes are `keys` and deeper."""
+        depth = len(keys) - 1
+        # `self.keys` hash every prefix of the sequence the path was cached from, not only the snapshot depths,
+        # so a sequence which left the path between two snapshots does not follow it
+        return (
+            len(self.path) > 0
+            and self.path[-1].depth > depth
+            and self.keys[depth] == keys[-1]
+        )
+
+    def extend(self, func, data):
+        """Append a call to the current sequence, which is being generated one call at a time."""
+        self.keys.append(prefix_key(self.keys[-1], func, data))
+
+    def wants(self, depth):
+        """Whether a snapshot should be cached after the first `depth` calls of the current sequence."""
+        return depth % self.interval == 0 and len(self.path) <= self.capacity
+
+    def add(self, depth, snapshotID, state, coverage):
+        """Cache a snapshot of the node taken after the first `depth` calls of the current sequence."""
+        self.path.append(
+            PrefixEntry(self.keys[depth], depth, snapshotID, state, coverage.copy())
+        )
+
+    def checkpoint(self, depth, state, coverage):
+        """Snapshot the node after the first `depth` calls of the current sequence if needed."""
+        if self.wants(depth):
+            self.add(depth, self.backend.snapshot(), state, coverage)
@@ -0,0 +1,173 @@
+import sys
+import json
+import time
+import bisect
+from collections import Counter
+from datetime import timedelta
+
+# Upper bounds, in seconds, of the buckets of the latency histograms (the last bucket is unbounded)
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+    1,
+    2,
+    5,
+)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("stats", "stage", "start")
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Stats:
+    """Per-stage timers, counters and latency histograms of a campaign.
+
+    `stage(name)` is a context manager timing a stage of the hot path. When the
+    statistics are disabled it returns a shared no-op context manager, and
+    every record method returns immediately, so that the instrumentation costs
+    a method call per stage. When enabled, a status line is printed and a JSON
+    line is appended to `export_path` every `interval` seconds.
+    """
+
+    def __init__(self, enabled=False, interval=10, export_path=None):
+        self.enabled = enabled
+        self.interval = interval
+        self.export_path = export_path
+        self.started = time.perf_counter()
+        self.last_status = self.started
+        self.times = Counter()
+        self.counts = Counter()
+        self.histograms = dict()
+        self.executions = 0
+        self.transactions = 0
+        self.tx_by_function = Counter()
+        self.reverts_by_function = Counter()
+        self.coverage = None  # coverage map whose size is reported
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name)
+
+    def add_time(self, stage, seconds):
+        self.times[stage] += seconds
+        self.counts[stage] += 1
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = [0] * (len(LATENCY_BUCKETS) + 1)
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def record_transaction(self, name, reverted):
+        """Count a transaction calling the function `name`, `reverted` is None if it is not known."""
+        if not self.enabled:
+            return
+        self.transactions += 1
+        if reverted is not None:
+            self.tx_by_function[name] += 1
+            self.reverts_by_function[name] += reverted
+
+    def record_execution(self):
+        """Count an executed sequence, and print the status if it is due."""
+        if not self.enabled:
+            return
+        self.executions += 1
+        now = time.perf_counter()
+        if now - self.last_status >= self.interval:
+            self.last_status = now
+            self.report()
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        traced = sum(self.tx_by_function.values())  # transactions whose outcome is known
+        return {
+            "time": time.time(),
+            "elapsed": elapsed,
+            "executions": self.executions,
+            "execs_per_sec": self.executions / elapsed if elapsed else 0.0,
+            "transactions": self.transactions,
+            "tx_per_sec": self.transactions / elapsed if elapsed else 0.0,
+            "coverage": self.coverage.size() if self.coverage is not None else 0,
+            "revert_rate": sum(self.reverts_by_function.values()) / traced
+            if traced
+            else 0.0,
+            "stages": {
+                stage: {
+                    "count": self.counts[stage],
+                    "total": self.times[stage],
+                    "histogram": self.histograms[stage],
+                }
+                for stage in self.times
+            },
+            "revert_rate_by_function": {
+                name: self.reverts_by_function[name] / count
+                for name, count in self.tx_by_function.items()
+            },
+        }
+
+    def report(self):
+        """Print the status line and append the statistics to the export file."""
+        summary = self.summary()
+        print(
+            f"[{timedelta(seconds=int(summary['elapsed']))}] "
+            f"execs {summary['executions']} ({summary['execs_per_sec']:.1f}/s) | "
+            f"txs {summary['transactions']} ({summary['tx_per_sec']:.1f}/s) | "
+            f"coverage {summary['coverage']} | "
+            f"reverts {100 * summary['revert_rate']:.1f}%",
+            file=sys.stderr,
+            flush=True,
+        )
+        if self.export_path:
+            with open(self.export_path, "a") as f:
+                f.write(json.dumps(summary) + "\n")
+
+    def print_stages(self):
+        """Print where the time of the campaign went, stage by stage."""
+        if not self.enabled:
+            return
+        self.report()
+        # stages are nested (execute contains send, trace, ...), so shares are relative to the whole campaign
+        elapsed = time.perf_counter() - self.started
+        print(f"{'stage':<12}{'count':>10}{'total (s)':>12}{'mean (ms)':>12}{'share':>8}")
+        for stage, seconds in self.times.most_common():
+            print(
+                f"{stage:<12}{self.counts[stage]:>10}{seconds:>12.2f}"
+                f"{1000 * seconds / self.counts[stage]:>12.2f}"
+                f"{100 * seconds / elapsed:>7.1f}%"
+            )
+        for name, count in self.tx_by_function.most_common():
+            print(
+                f"{name}: {count} transactions, {100 * self.reverts_by_function[name] / count:.1f}% reverted"
+            )
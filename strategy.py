@@ -1,5 +1,5 @@
 from eth_abi.tools import get_abi_strategy
-from abi import get_functions
+from abi import get_functions, function_encoder
 from hypothesis import given, settings
 
 
@@ -10,6 +10,7 @@ def get_strategies(test_file_name):
         for func in functions[contract]:
             func_name = func["name"]
             args = func["inputs"]
+            func["selector"], func["encoder"] = function_encoder(func)
 
             if len(args):
                 if len(args) > 1:
@@ -0,0 +1,36 @@
+from abi import CompiledFunction, source_files
+
+ADDRESS = "0x0000000000000000000000000000000000000001"
+
+
+def function_abi(name, inputs):
+    return {"type": "function", "name": name, "inputs": inputs, "outputs": []}
+
+
+def test_zero_argument_function():
+    func = CompiledFunction(ADDRESS, function_abi("setUp", []))
+    assert func.calldata() == "0x0a9254e4"
+
+
+def test_one_argument_function():
+    func = CompiledFunction(
+        ADDRESS, function_abi("set", [{"name": "x", "type": "uint256"}])
+    )
+    assert func.calldata(1) == "0x60fe47b1" + f"{1:064x}"
+
+
+def test_source_files_follow_non_relative_imports(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "Token.sol").write_text('import "Math.sol";')
+    (tmp_path / "src" / "Math.sol").write_text("")
+    (tmp_path / "Test.sol").write_text('import "src/Token.sol";')
+    assert source_files("Test.sol") == sorted(
+        str(tmp_path / name) for name in ("Test.sol", "src/Token.sol", "src/Math.sol")
+    )
+
+
+def test_source_files_unresolved_import(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "Test.sol").write_text('import "forge-std/Test.sol";')
+    assert source_files("Test.sol") is None
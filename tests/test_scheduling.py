@@ -0,0 +1,36 @@
+from collections import Counter
+from hypothesis import given, settings, strategies as st
+from scheduling import RevertScheduler, weighted_one_of
+
+OPERATIONS = 8
+EXAMPLES = 4000
+
+
+def drawn_operations(scheduler, functions):
+    drawn = Counter()
+    operations = [st.just(i) for i in range(OPERATIONS)]
+
+    @settings(max_examples=EXAMPLES, database=None, deadline=None)
+    @given(weighted_one_of(scheduler, operations, functions))
+    def draw(i):
+        drawn[i] += 1
+
+    draw()
+    return drawn
+
+
+def test_equal_weights_are_drawn_uniformly():
+    drawn = drawn_operations(RevertScheduler(), list(range(OPERATIONS)))
+    total = sum(drawn.values())
+    for i in range(OPERATIONS):
+        assert abs(drawn[i] / total - 1 / OPERATIONS) < 0.04
+
+
+def test_reverting_functions_are_drawn_less():
+    scheduler = RevertScheduler()
+    for _ in range(200):
+        scheduler.record(0, True)
+        for func in range(1, OPERATIONS):
+            scheduler.record(func, False)
+    drawn = drawn_operations(scheduler, list(range(OPERATIONS)))
+    assert drawn[0] < min(drawn[i] for i in range(1, OPERATIONS)) / 2
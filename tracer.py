@@ -0,0 +1,269 @@
+import re
+from coverage_tracker import COVERAGE_KEYS, ENTRY, code_id, pack_id
+
+
+# Geth-style javascript tracer: the node only sends back the unique coverage
+# IDs of the transaction, instead of one structLog per executed opcode, whether
+# the transaction wrote to the state and whether it reverted. A coverage ID is
+# made of the index of the executing address in `addrs`, then the source of the
+# edge (0 for a pc) and the pc on 16 bits each. Creation code is not covered.
+COVERAGE_TRACER = """{
+    frames: [],
+    addrs: [],
+    addrIndex: {},
+    seen: {},
+    ids: [],
+    writes: false,
+    cmps: [],
+    seenCmps: {},
+    frame: function(address, creation) {
+        if (creation) return {addr: -1, prev: -1};
+        if (this.addrIndex[address] === undefined) {
+            this.addrIndex[address] = this.addrs.length;
+            this.addrs.push(address);
+        }
+        return {addr: this.addrIndex[address], prev: %d};
+    },
+    enter: function(frame) {
+        var type = frame.getType();
+        this.frames.push(this.frame(toHex(frame.getTo()), type === "CREATE" || type === "CREATE2"));
+    },
+    exit: function(result) { this.frames.pop(); },
+    step: function(log, db) {
+        if (!this.writes) {
+            var op = log.op.toString();
+            if (op === "SSTORE" || op === "CREATE" || op === "CREATE2" || op === "SELFDESTRUCT") {
+                this.writes = true;
+            }
+        }
+        /*COMPARISONS*/
+        if (this.frames.length === 0) this.frames.push(this.frame(toHex(log.contract.getAddress()), false));
+        var top = this.frames[this.frames.length - 1];
+        if (top.addr === -1) return;
+        var pc = log.getPC();
+        /*COVERAGE*/
+    },
+    fault: function(log, db) {},
+    result: function(ctx, db) { return {addrs: this.addrs, ids: this.ids, writes: this.writes && !ctx.error, failed: !!ctx.error, cmps: this.cmps}; }
+}""" % ENTRY
+
+# Body of the step function per coverage key : every pc, or the pcs reached by a jump or on entering the code
+COVERAGE_STEPS = {
+    "pc": """var id = top.addr * 4294967296 + pc;
+        if (this.seen[id] === undefined) {
+            this.seen[id] = true;
+            this.ids.push(id);
+        }""",
+    "edge": """if (top.prev !== -1) {
+            var id = top.addr * 4294967296 + top.prev * 65536 + pc;
+            if (this.seen[id] === undefined) {
+                this.seen[id] = true;
+                this.ids.push(id);
+            }
+        }
+        var jump = log.op.toNumber();
+        top.prev = jump === 0x56 || jump === 0x57 ? pc : -1;""",
+}
+
+# Maximal number of comparison operands sent back per transaction
+MAX_COMPARISONS = 256
+
+# Collection of the unique operands of the comparisons, at every depth
+COMPARISONS = """var cmp = log.op.toString();
+        if (this.cmps.length < %d && (cmp === "EQ" || cmp === "LT" || cmp === "GT" || cmp === "SLT" || cmp === "SGT")) {
+            for (var i = 0; i < 2; i++) {
+                var operand = log.stack.peek(i).toString(16);
+                if (this.seenCmps[operand] === undefined) {
+                    this.seenCmps[operand] = true;
+                    this.cmps.push(operand);
+                }
+            }
+        }""" % MAX_COMPARISONS
+
+
+def js_tracer(key, comparisons):
+    """Return the javascript tracer collecting the coverage IDs of `key`, and the comparison operands if `comparisons`."""
+    tracer = COVERAGE_TRACER.replace("/*COVERAGE*/", COVERAGE_STEPS[key])
+    if comparisons:
+        tracer = tracer.replace("/*COMPARISONS*/", COMPARISONS)
+    return tracer
+
+
+STRUCT_LOGS_OPTIONS = {
+    "disableStorage": True,
+    "disableStack": True,
+    "disableMemory": True,
+    "enableMemory": False,
+    "enableReturnData": False,
+}
+
+# pc and op always come first and before depth inside a structLog, and with stack, memory and
+# storage disabled a structLog does not contain any nested object
+STRUCT_LOG_PATTERN = re.compile(rb'"pc":(\d+),"op":"(\w+)",[^{}]*?"depth":(\d+)')
+
+# Opcodes which modify the state of the chain
+WRITE_OPS = ("SSTORE", "CREATE", "CREATE2", "SELFDESTRUCT")
+WRITE_OP_PATTERN = re.compile(rb'"op":"(?:SSTORE|CREATE|CREATE2|SELFDESTRUCT)"')
+
+JUMP_OPS = ("JUMP", "JUMPI")
+
+TRACER_MODES = ("js", "stream", "struct_logs")
+
+
+class TracerException(Exception):
+    """The node does not support the requested coverage tracer."""
+
+    pass
+
+
+class CoverageCollector:
+    """Collect the coverage IDs of a transaction, whether it wrote to the state and whether it reverted.
+
+    - `js` : a custom javascript tracer deduplicates the coverage IDs inside the node, at every depth
+    - `stream` : structLogs are parsed from the raw HTTP response without decoding the JSON
+    - `struct_logs` : the full structLogs array is decoded by web3
+
+    Coverage IDs are keyed by the hash of the executing code (see
+    `coverage_tracker.pack_id`), so that a library called by delegatecall or
+    a contract deployed twice is covered once. The code of an address is
+    fetched the first time it is executed and assumed not to change during
+    the campaign. The structLogs modes only cover the called contract (depth
+    1), since the structLogs do not tell which address executes a deeper call.
+
+    With a `dictionary`, the javascript tracer also collects the operands of
+    the comparisons executed by the transaction into it. The other modes trace
+    without the stack, so they do not collect them.
+    """
+
+    def __init__(self, w3, rpc, mode="js", dictionary=None, key="edge"):
+        if mode not in TRACER_MODES:
+            raise TracerException(
+                f"coverage_tracer should be one of {', '.join(TRACER_MODES)}"
+            )
+        if key not in COVERAGE_KEYS:
+            raise TracerException(
+                f"coverage_key should be one of {', '.join(COVERAGE_KEYS)}"
+            )
+        self.w3 = w3
+        self.rpc = rpc
+        self.mode = mode
+        self.key = key
+        self.dictionary = dictionary
+        self.js_tracer = js_tracer(key, dictionary is not None)
+        self.code_ids = dict()
+
+    def with_client(self, rpc):
+        """Return a collector with the same settings sending its requests through `rpc`, to be used from another thread."""
+        return CoverageCollector(self.w3, rpc, self.mode, self.dictionary, self.key)
+
+    def code_id(self, address):
+        """Return the identifier of the code of `address`, cached by address."""
+        address = address.lower()
+        code = self.code_ids.get(address)
+        if code is None:
+            code = code_id(
+                bytes.fromhex(self.rpc.request("eth_getCode", [address, "latest"])[2:])
+            )
+            self.code_ids[address] = code
+        return code
+
+    def summarize(self, result, to):
+        """Extract (coverage IDs, writes, reverted) from the result of the javascript tracer or of a structLogs trace of a transaction to `to`."""
+        reverted = result.get("failed", False)
+        if self.dictionary is not None and "cmps" in result:
+            self.dictionary.update(int(operand, 16) for operand in result["cmps"])
+        if "structLogs" in result:
+            structLogs = result["structLogs"]
+            ids = set()
+            self._add_steps(
+                ids,
+                ((ele["pc"], ele["op"]) for ele in structLogs if ele["depth"] == 1),
+                self.code_id(to),
+                ENTRY,
+            )
+            writes = not reverted and any(
+                ele["op"] in WRITE_OPS for ele in structLogs
+            )
+            return ids, writes, reverted
+        codes = [self.code_id(address) << 32 for address in result["addrs"]]
+        ids = {codes[ID >> 32] | (ID & 0xFFFFFFFF) for ID in result["ids"]}
+        return ids, result["writes"], reverted
+
+    def _add_steps(self, ids, steps, code, source):
+        """Add the coverage IDs of the (pc, op) steps executed by `code` in a row, return the source of the next edge."""
+        for pc, op in steps:
+            if self.key == "pc":
+                ids.add(pack_id(code, 0, pc))
+            elif source is not None:
+                ids.add(pack_id(code, source, pc))
+            source = pc if op in JUMP_OPS else None
+        return source
+
+    def tracer_options(self):
+        """Options of a debug_trace* request for the current mode, the stream mode is only used for single transactions."""
+        if self.mode == "js":
+            return {"tracer": self.js_tracer}
+        return STRUCT_LOGS_OPTIONS
+
+    def collect(self, tx_hash, to):
+        """Return the coverage IDs of the transaction to `to`, whether it wrote to the state and whether it reverted."""
+        if isinstance(tx_hash, bytes):
+            tx_hash = "0x" + bytes(tx_hash).hex()
+        if self.mode == "js":
+            try:
+                return self._collect_js(tx_hash, to)
+            except TracerException:
+                # the node does not support javascript tracers
+                self.mode = "stream"
+        if self.mode == "stream":
+            return self._collect_stream(tx_hash, to)
+        return self.summarize(
+            self.w3.provider.make_request(
+                "debug_traceTransaction", [tx_hash, STRUCT_LOGS_OPTIONS]
+            )["result"],
+            to,
+        )
+
+    def _collect_js(self, tx_hash, to):
+        response = self.rpc.batch(
+            [("debug_traceTransaction", [tx_hash, {"tracer": self.js_tracer}])]
+        )[0]
+        if "error" in response:
+            raise TracerException(response["error"])
+        return self.summarize(response["result"], to)
+
+    def _collect_stream(self, tx_hash, to):
+        response = self.rpc.post(
+            self.rpc.payload("debug_traceTransaction", [tx_hash, STRUCT_LOGS_OPTIONS]),
+            stream=True,
+        )
+        code = self.code_id(to)
+        ids = set()
+        source = ENTRY
+        writes = False
+        failed = False
+        buffer = b""
+        head = b""
+        for chunk in response.iter_content(chunk_size=1 << 16):
+            if len(head) < 64:
+                head += chunk[:64]
+                if b'"error"' in head:
+                    raise TracerException(chunk.decode(errors="replace"))
+            buffer += chunk
+            failed = failed or b'"failed":true' in buffer
+            end = buffer.rfind(b"}")
+            if end == -1:
+                continue
+            source = self._add_steps(
+                ids,
+                (
+                    (int(m.group(1)), m.group(2).decode())
+                    for m in STRUCT_LOG_PATTERN.finditer(buffer, 0, end + 1)
+                    if m.group(3) == b"1"
+                ),
+                code,
+                source,
+            )
+            writes = writes or WRITE_OP_PATTERN.search(buffer, 0, end + 1) is not None
+            buffer = buffer[end + 1 :]
+        return ids, writes and not failed, failed
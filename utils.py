@@ -1,71 +1,293 @@
-from slither import Slither
-from slither.printers.guidance import echidna
+import os
+import re
+import json
+from decimal import Decimal, InvalidOperation
 from web3 import Web3
 from hypothesis import strategies as st
+from hypothesis.strategies._internal.collections import ListStrategy, TupleStrategy
+from abi import load_artifact
 
+# Mined constants, one file per hash of the sources
+CONSTANTS_CACHE_DIR = ".fuzz_cache/constants"
 
-def augment_strategies_with_constants(test_file_name, fuzz_candidates):
-    # extract constants hardcoded in the smart contract
-    slither = Slither(test_file_name)
-    L_constants = dict()
-    types_of_interest = ["int", "address", "string"]
+PUSH1 = 0x60
+PUSH32 = 0x7F
+JUMP = 0x56
+JUMPI = 0x57
+
+# Multipliers of the number literals with a unit
+SUBDENOMINATIONS = {
+    "wei": 1,
+    "gwei": 10**9,
+    "szabo": 10**12,
+    "finney": 10**15,
+    "ether": 10**18,
+    "seconds": 1,
+    "minutes": 60,
+    "hours": 3600,
+    "days": 86400,
+    "weeks": 604800,
+}
+
+BINARY_PATTERN = re.compile(r"binary\(min_size=(\d+), max_size=(\d+)\)$")
+ADDRESS_STRATEGY = "binary(min_size=20, max_size=20).map(to_checksum_address)"
+
+
+def strip_metadata(code):
+    """Remove the CBOR-encoded metadata appended by solc to a runtime bytecode."""
+    if len(code) < 2:
+        return code
+    length = int.from_bytes(code[-2:], "big")
+    if length + 2 > len(code):
+        return code
+    return code[: -(length + 2)]
+
+
+def bytecode_constants(runtime_bytecode, L_constants):
+    """Add the PUSH immediates of a runtime bytecode, except jump destinations, to the constants."""
+    try:
+        code = strip_metadata(bytes.fromhex(runtime_bytecode))
+    except ValueError:  # unlinked library placeholders
+        return
+    i = 0
+    while i < len(code):
+        op = code[i]
+        i += 1
+        if op < PUSH1 or op > PUSH32:
+            continue
+        size = op - PUSH1 + 1
+        immediate = code[i : i + size]
+        i += size
+        if i < len(code) and code[i] in (JUMP, JUMPI):
+            continue
+        value = int.from_bytes(immediate, "big")
+        L_constants["int"].add(value)
+        if size == 20 and value != 0:
+            L_constants["address"].add(Web3.to_checksum_address(immediate))
+        if immediate.rstrip(b"\0"):
+            # bytesN constants are left-aligned
+            L_constants["bytes"].add(immediate.rstrip(b"\0"))
+
+
+def literal_number(node):
+    """Return the value of a number literal of the AST, None if it is not an integer."""
+    value = node["value"].replace("_", "")
+    try:
+        if value.startswith("0x"):
+            number = Decimal(int(value, 16))
+        else:
+            number = Decimal(value)
+    except (ValueError, InvalidOperation):
+        return None
+    number *= SUBDENOMINATIONS.get(node.get("subdenomination"), 1)
+    if number != number.to_integral_value():
+        return None
+    return int(number)
+
+
+def ast_constants(ast, L_constants):
+    """Add the literals of a solc AST to the constants."""
+    to_visit = [ast]
+    while to_visit:
+        node = to_visit.pop()
+        if isinstance(node, list):
+            to_visit.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        if node.get("nodeType") == "Literal":
+            kind = node.get("kind")
+            if kind == "number":
+                number = literal_number(node)
+                if number is None:
+                    continue
+                type_string = node.get("typeDescriptions", {}).get("typeString", "")
+                if type_string.startswith("address"):
+                    L_constants["address"].add(
+                        Web3.to_checksum_address(number.to_bytes(20, "big"))
+                    )
+                else:
+                    L_constants["int"].add(number)
+            elif kind in ("string", "unicodeString", "hexString"):
+                if node.get("value") is not None:
+                    L_constants["string"].add(node["value"])
+                if node.get("hexValue"):
+                    L_constants["bytes"].add(bytes.fromhex(node["hexValue"]))
+            continue
+        if (
+            node.get("nodeType") == "UnaryOperation"
+            and node.get("operator") == "-"
+            and node.get("subExpression", {}).get("kind") == "number"
+        ):
+            number = literal_number(node["subExpression"])
+            if number is not None:
+                L_constants["int"].add(-number)
+        to_visit.extend(node.values())
+
+
+def mine_constants(test_file_name, cache_dir=CONSTANTS_CACHE_DIR):
+    """Extract the constants hardcoded in the compiled test file, from its ASTs and runtime bytecodes.
+
+    The constants are cached by hash of the sources, so that they are only mined once.
     """
-    We group uintN and intN in a unique int category
-    SlithIR literals types <--> Solidity types 
-    'uint256' : used for all uintN and bytesN
-    'int256' : used for all intN
-    'address' : for 'address' or 'address payable'
-    'string' : used for string or bytes
+    artifact = load_artifact(test_file_name)
+    cached = os.path.join(cache_dir, os.path.basename(artifact.path))
+    if os.path.exists(cached):
+        with open(cached) as f:
+            saved = json.load(f)
+        return {
+            "int": set(saved["int"]),
+            "address": set(saved["address"]),
+            "string": set(saved["string"]),
+            "bytes": {bytes.fromhex(b) for b in saved["bytes"]},
+        }
+
+    L_constants = {"int": set(), "address": set(), "string": set(), "bytes": set()}
+    for ast in artifact.asts.values():
+        ast_constants(ast, L_constants)
+    for runtime_bytecode in artifact.runtime_bytecodes.values():
+        bytecode_constants(runtime_bytecode, L_constants)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # written aside then renamed, so that another worker never loads a partial file
+    tmp_path = f"{cached}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {
+                "int": sorted(L_constants["int"]),
+                "address": sorted(L_constants["address"]),
+                "string": sorted(L_constants["string"]),
+                "bytes": sorted(b.hex() for b in L_constants["bytes"]),
+            },
+            f,
+        )
+    os.replace(tmp_path, cached)
+    return L_constants
+
+
+def dictionary_strategy(dictionary, convert, stg):
+    """`stg`, or a value of the runtime `dictionary` converted by `convert` (which returns None if it does not fit).
+
+    The dictionary keeps growing during the campaign : an index is drawn, and
+    `stg` is drawn instead if there is no value at that index yet. The bit
+    length of the index is drawn first, so that the few values of a young
+    dictionary are drawn often, while the bounds of both draws stay fixed for
+    the replays.
     """
-    for toi in types_of_interest:
-        L_constants[toi] = set()
-
-    for contract_name, dict_constants_per_contract in echidna._extract_constants(
-        slither
-    )[0].items():
-        for function, list_constants_per_func in dict_constants_per_contract.items():
-            for constant_value in list_constants_per_func:
-                if constant_value.type == "address":
-                    L_constants[constant_value.type].add(
-                        Web3.to_checksum_address(hex(int(constant_value.value)))
-                    )
-                elif "int" in constant_value.type:  # uint or int
-                    L_constants["int"].add(int(constant_value.value))
-                elif constant_value.type == "string":
-                    s = constant_value.value
-                    L_constants[constant_value.type].add(s)
+    max_bits = (dictionary.capacity - 1).bit_length()
+
+    @st.composite
+    def dictionary_value(draw):
+        bits = draw(st.integers(0, max_bits))
+        value = dictionary.get(draw(st.integers(0, (1 << bits) - 1)))
+        if value is not None:
+            value = convert(value)
+        if value is None:
+            return draw(stg)
+        return value
+
+    return st.one_of(stg, dictionary_value())
+
+
+def integer_converter(start, end):
+    def convert(word):
+        if start < 0 and word >= 2**255:
+            word -= 2**256
+        if start <= word <= end:
+            return word
+        return None
+
+    return convert
+
+
+def address_converter(word):
+    if 0 < word < 2**160:
+        return Web3.to_checksum_address(word.to_bytes(20, "big"))
+    return None
+
+
+def bytes_converter(size):
+    def convert(word):
+        if word < 2 ** (8 * size):
+            return word.to_bytes(size, "big")
+        if word % 2 ** (8 * (32 - size)) == 0:  # left-aligned
+            return word.to_bytes(32, "big")[:size]
+        return None
+
+    return convert
+
+
+def augment_strategies_with_constants(
+    test_file_name, fuzz_candidates, L_constants=None, dictionary=None
+):
+    """Let the arguments also be drawn from the constants of the code, and from the values of a runtime `dictionary`."""
+    if L_constants is None:
+        L_constants = mine_constants(test_file_name)
+
+    def with_dictionary(convert, stg):
+        if dictionary is None:
+            return stg
+        return dictionary_strategy(dictionary, convert, stg)
+
+    def with_constants(constants, stg):
+        if len(constants) == 0:
+            return stg
+        return st.one_of(st.sampled_from(sorted(constants)), stg)
+
+    def fixed_size_bytes(size):
+        constants = {
+            b.ljust(size, b"\0") for b in L_constants["bytes"] if len(b) <= size
+        }
+        constants.update(
+            integer.to_bytes(size, "big")
+            for integer in L_constants["int"]
+            if 0 <= integer < 2 ** (8 * size)
+        )
+        return constants
 
     def augment_simple_stg(stg):
         stg_augmented = stg
+        wstg = stg.wrapped_strategy if hasattr(stg, "wrapped_strategy") else stg
         if str(stg)[:8] == "integers":
-            if hasattr(stg, "wrapped_strategy"):
-                wstg = stg.wrapped_strategy
-            else:
-                wstg = stg
             L_ints_to_add = []
             for integer in L_constants["int"]:
                 if integer >= wstg.start and integer <= wstg.end:
                     L_ints_to_add.append(integer)
-            stg_augmented = st.one_of(st.sampled_from(L_ints_to_add), stg)
-        if str(stg)[:4] == "text":
-            stg_augmented = st.one_of(st.sampled_from(list(L_constants["string"])), stg)
-        if str(stg) == "binary(min_size=20, max_size=20).map(to_checksum_address)":
-            stg_augmented = st.one_of(
-                st.sampled_from(list(L_constants["address"])), stg
+            stg_augmented = with_dictionary(
+                integer_converter(wstg.start, wstg.end),
+                with_constants(L_ints_to_add, stg),
+            )
+        elif str(stg)[:4] == "text":
+            stg_augmented = with_constants(L_constants["string"], stg)
+        elif str(stg) == ADDRESS_STRATEGY:
+            stg_augmented = with_dictionary(
+                address_converter, with_constants(L_constants["address"], stg)
+            )
+        elif str(stg)[:6] == "binary":
+            size = BINARY_PATTERN.match(str(stg))
+            if size and size.group(1) == size.group(2):  # bytesN
+                stg_augmented = with_dictionary(
+                    bytes_converter(int(size.group(1))),
+                    with_constants(fixed_size_bytes(int(size.group(1))), stg),
+                )
+            else:
+                stg_augmented = with_constants(
+                    L_constants["bytes"] | {s.encode() for s in L_constants["string"]},
+                    stg,
+                )
+        elif isinstance(wstg, ListStrategy):
+            stg_augmented = st.lists(
+                augment_simple_stg(wstg.element_strategy),
+                min_size=wstg.min_size,
+                max_size=None if wstg.max_size == float("inf") else wstg.max_size,
+            )
+        elif isinstance(wstg, TupleStrategy):
+            stg_augmented = st.tuples(
+                *[augment_simple_stg(elt) for elt in wstg.element_strategies]
             )
         return stg_augmented
 
-    fuzz_candidates_augmented = []
-    for fuzz_can in fuzz_candidates:
-        if str(fuzz_can[1])[:6] == "tuples":
-            elt_strategies = fuzz_can[1].wrapped_strategy.element_strategies
-            List_stg_augmented = []
-            for stg in elt_strategies:
-                List_stg_augmented.append(augment_simple_stg(stg))
-            fuzz_can[1].wrapped_strategy.element_strategies = tuple(List_stg_augmented)
-            fuzz_candidates_augmented.append(fuzz_can)
-        else:
-            fuzz_can = fuzz_can[0], augment_simple_stg(fuzz_can[1])
-            fuzz_candidates_augmented.append(fuzz_can)
+    return [
+        (fuzz_can[0], augment_simple_stg(fuzz_can[1])) for fuzz_can in fuzz_candidates
+    ]
 
-    return fuzz_candidates_augmented